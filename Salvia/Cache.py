@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+class RenderCache():
+    """ content addressed store of rendered files
+
+        entries are keyed by a hash of the generated script and the
+        data buffers, files of an entry are stored as <key><suffix>.
+        The cache is bounded by total size and age, least recently
+        used files are evicted first.
+    """
+
+    def __init__(self, root, max_bytes=500*1024**2, max_age=7*24*3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(script, buffers=()):
+        """ hash of a script and a sequence of buffers or digests """
+        h = hashlib.sha1(script.encode("utf-8"))
+        for buf in buffers:
+            h.update(buf.encode("ascii") if isinstance(buf, str) else buf)
+        return h.hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.root, key + suffix)
+
+    def fetch(self, key, targets):
+        """ copy the cached files of key to targets, a dict of suffix to
+            path, returns False if any of the files is missing """
+        cached = {s: self.path(key, s) for s in targets}
+        if not all(os.path.exists(p) for p in cached.values()):
+            return False
+        try:
+            for suffix, target in targets.items():
+                shutil.copyfile(cached[suffix], target)
+                os.utime(cached[suffix])
+        except OSError:
+            # evicted meanwhile
+            return False
+        return True
+
+    def store(self, key, targets):
+        """ add rendered files, a dict of suffix to path, to the cache """
+        for suffix, target in targets.items():
+            if not os.path.exists(target):
+                continue
+            fd, tmp = tempfile.mkstemp(dir=self.root)
+            os.close(fd)
+            shutil.copyfile(target, tmp)
+            os.replace(tmp, self.path(key, suffix))
+        self.evict()
+
+    def entries(self):
+        ret = []
+        for fn in os.listdir(self.root):
+            path = os.path.join(self.root, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ret.append((st.st_mtime, st.st_size, path))
+        return sorted(ret)
+
+    def evict(self):
+        """ remove files older than max_age and the least recently used
+            files until the cache is smaller than max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            if now - mtime < self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        """ remove the files of key or clear the whole cache """
+        for _, _, path in self.entries():
+            if not key or os.path.basename(path).startswith(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
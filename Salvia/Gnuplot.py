@@ -1,15 +1,73 @@
 from collections import OrderedDict
 import subprocess
-from itertools import cycle
+from itertools import cycle, count
 import os
-import time
 import re
+import hashlib
+import asyncio
+import threading
+import tempfile
+import weakref
+from contextlib import nullcontext
 from binascii import b2a_hex, b2a_base64, hexlify
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import Session
+from . import Cache
+from . import Workspace
+from . import Stats
+from . import Series
 
 
 
 NumberTypes = (int, float, complex)
 
+_generations = count(1)
+
+
+class TrackedDict(dict):
+    """ dict with a generation number which is renewed on every change,
+        used to invalidate cached script fragments. In place changes of
+        mutable values are not tracked """
+
+    def __init__(self, *args, **kwargs):
+        super(TrackedDict, self).__init__(*args, **kwargs)
+        self.generation = next(_generations)
+
+    def changed(self):
+        self.generation = next(_generations)
+
+    def __setitem__(self, key, value):
+        super(TrackedDict, self).__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super(TrackedDict, self).__delitem__(key)
+        self.changed()
+
+    def update(self, *args, **kwargs):
+        super(TrackedDict, self).update(*args, **kwargs)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        self.changed()
+        return super(TrackedDict, self).setdefault(key, default)
+
+    def pop(self, *args):
+        self.changed()
+        return super(TrackedDict, self).pop(*args)
+
+    def popitem(self):
+        self.changed()
+        return super(TrackedDict, self).popitem()
+
+    def clear(self):
+        super(TrackedDict, self).clear()
+        self.changed()
+
+
 color_palette = [
     # '#0000ff', # blue
     # '#007f00', # green
@@ -49,7 +107,7 @@ color_palette = [
 #  '#a2142f', # red
     ]
 
-rcParams = {
+rcParams = TrackedDict({
     'colors': color_palette,
     'figure_width_px': 255,
     'figure_height_px': 255,
@@ -87,9 +145,71 @@ rcParams = {
     'png_terminal_options': '',
     'legend_position': 'top right',
     'exp_line_width': 1,
-}
-
-class RcParams(dict):
+    # how series data is passed to gnuplot: 'inline' heredocs,
+    # 'binary' files, 'auto' to switch to binary for large series or
+    # 'mmap' for a single memory mapped file holding all series
+    'data_transport': 'auto',
+    'binary_min_points': 10000,
+    # run scripts on a pool of long lived gnuplot processes
+    'gnuplot_pool': True,
+    'gnuplot_pool_size': 2,
+    'gnuplot_timeout': 60,
+    'gnuplot_max_jobs': 500,
+    # formats produced by write_file, rendered from a single script
+    # sharing the data blocks if multi_target is set
+    'formats': ['eps', 'svg', 'png'],
+    'multi_target': True,
+    # number of concurrent renders used by render_many
+    'render_workers': os.cpu_count() or 1,
+    # formats rendered for display if the frontend does not ask for any
+    'display_formats': ['png'],
+    # reuse rendered files of identical scripts and data
+    'render_cache': False,
+    'render_cache_dir': os.path.expanduser("~/.cache/Salvia"),
+    'render_cache_max_bytes': 500*1024**2,
+    'render_cache_max_age': 7*24*3600,
+    # reduce line series to a min/max envelope per pixel column
+    'decimate': True,
+    # scripts are generated in chunks of at most stream_chunk_rows data
+    # lines and written to a 'file' or a gnuplot stdin 'pipe'
+    'stream_chunk_rows': 10000,
+    'script_sink': 'file',
+    # share data blocks between series with identical x columns and
+    # store identical columns only once
+    'dedupe_data': True,
+    # write all y columns of a draw call into a single data block
+    'columnar': True,
+    # rows per chunk when scanning data files for axis ranges
+    'file_scan_chunk_rows': 1000000,
+    # render displayed formats in memory instead of via files, see
+    # to_bytes. Multiplots rendered as tiles are displayed from files
+    'display_in_memory': True,
+    # every render gets its own directory below workspace_root, e.g.
+    # a tmpfs like /dev/shm. Directories older than workspace_max_age
+    # or exceeding workspace_max_bytes are removed, but never within
+    # workspace_min_age seconds after their last modification
+    'workspace_root': os.path.join(tempfile.gettempdir(), "Salvia"),
+    'workspace_max_bytes': 1024**3,
+    'workspace_max_age': 24*3600,
+    'workspace_min_age': 600,
+    # record timings and counters of each render in multiplot.stats,
+    # passed to stats_callback(multiplot, stats) and appended to
+    # stats_file if these are set, see Stats.RenderStats
+    'render_stats': False,
+    'stats_callback': None,
+    'stats_file': None,
+    # render multiplots with more than tile_rows rows of subplots as
+    # tiles of tile_rows rows concurrently, see render_tiled
+    'tile_rows': 0,
+})
+
+# formats which can be displayed by a frontend, keyed by mimetype
+mimetypes = OrderedDict([
+    ('image/png', 'png'),
+    ('image/svg+xml', 'svg'),
+])
+
+class RcParams(TrackedDict):
     """ hold local rcParams and delegate to global """
 
     def __getitem__(self, key):
@@ -99,9 +219,37 @@ class RcParams(dict):
             return rcParams.get(key, None)
 
 
+def fragment_stamp(canvas):
+    """ generations of the rcParams a cached fragment depends on """
+    local = getattr(canvas, "rcParams", None)
+    return (rcParams.generation, getattr(local, "generation", 0))
+
+
 class PlotProperty():
     """ Base class holding properties of a plot which
-        are usually specified by set and unset commands """
+        are usually specified by set and unset commands
+
+        generated script fragments are cached until an attribute of
+        the property, the rcParams or the rcParams of its canvas change
+    """
+
+    __slots__ = ("revision", "fragments")
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "revision", next(_generations))
+        object.__setattr__(self, "fragments", None)
+
+    def fragment(self, key, build, *args):
+        """ cached result of build(*args) """
+        stamp = fragment_stamp(getattr(self, "canvas", None))
+        fragments = self.fragments
+        if fragments is None or fragments[None] != stamp:
+            fragments = {None: stamp}
+            object.__setattr__(self, "fragments", fragments)
+        if key not in fragments:
+            fragments[key] = build(*args)
+        return fragments[key]
 
     @property
     def text(self):
@@ -114,11 +262,16 @@ class PlotProperty():
 
 class Grid(PlotProperty):
 
+    __slots__ = ("visible",)
+
     def __init__(self, canvas=None, visible=True):
         self.visible = visible
 
     @property
     def text(self):
+        return self.fragment("text", self._text)
+
+    def _text(self):
         if self.visible:
             return "set grid\n"
         else:
@@ -126,6 +279,9 @@ class Grid(PlotProperty):
 
     @property
     def post_text(self):
+        return self.fragment("post_text", self._post_text)
+
+    def _post_text(self):
         if self.visible:
             return "unset grid\n"
         else:
@@ -134,6 +290,9 @@ class Grid(PlotProperty):
 
 class Label(PlotProperty):
 
+    __slots__ = ("axis", "axis_normalised", "name", "canvas", "visible",
+                 "exp_format", "exp_offset", "exp_tics", "svg")
+
     def __init__(self, axis, text, svg, canvas=None, visible=True):
         self.axis = axis
         self.axis_normalised = axis.replace("2", "")
@@ -177,6 +336,9 @@ class Label(PlotProperty):
         return val
 
     def tics(self, _range):
+        return self.fragment(("tics", tuple(_range)), self._tics, _range)
+
+    def _tics(self, _range):
         if self.exp_tics:
             val = self.exp_tics
         elif self.canvas:
@@ -192,6 +354,9 @@ class Label(PlotProperty):
         return "set {}tics {}, {}, {}\n".format(self.axis, min(l,u), tics, 0.9*max(l,u))
 
     def text(self, svg):
+        return self.fragment(("text", svg), self._text, svg)
+
+    def _text(self, svg):
         if not self.visible:
             return 'set format {} ""\n'.format(self.axis)
         off = self._offs
@@ -208,6 +373,9 @@ class Label(PlotProperty):
 
     @property
     def post_text(self):
+        return self.fragment("post_text", self._post_text)
+
+    def _post_text(self):
         if self.visible:
             return 'set {}label ""\n'.format(self.axis)
         else:
@@ -216,6 +384,8 @@ class Label(PlotProperty):
 
 class Size(PlotProperty):
 
+    __slots__ = ("exp_ratio", "exp_size", "canvas")
+
     def __init__(self, ratio=None, size=None, canvas=None):
         self.exp_ratio = ratio
         self.exp_size = size
@@ -249,12 +419,17 @@ class Size(PlotProperty):
 
     @property
     def text(self):
+        return self.fragment("text", self._text)
+
+    def _text(self):
         return "set size ratio {} {}\n".format(
                 self.ratio, " ".join(map(str, self.size)))
 
 
 class Legend(PlotProperty):
 
+    __slots__ = ("visible", "orientation", "canvas", "legends")
+
     def __init__(self, orientation=None, canvas=None):
         self.visible = True
         self.orientation = orientation
@@ -263,6 +438,9 @@ class Legend(PlotProperty):
 
     @property
     def text(self):
+        return self.fragment("text", self._text)
+
+    def _text(self):
         if not self.visible:
             return "unset key\n"
         t = "set key {}\n"
@@ -280,22 +458,39 @@ class Legend(PlotProperty):
 
 class TextLabels(list):
 
+    __slots__ = ("fragments",)
+
+    def fragment(self, fmt):
+        """ labels formatted with fmt, cached as long as the labels
+            do not change """
+        labels = tuple(self)
+        fragments = getattr(self, "fragments", None)
+        if fragments is None or fragments[None] != labels:
+            fragments = self.fragments = {None: labels}
+        if fmt not in fragments:
+            fragments[fmt] = "".join(fmt.format(i+1, t)
+                                     for i, t in enumerate(labels))
+        return fragments[fmt]
+
     @property
     def text(self):
-        o = ""
-        for i, t in enumerate(self):
-            o += "set label {} {}\n".format(i+1, t)
-        return o
+        return self.fragment("set label {} {}\n")
 
     @property
     def post_text(self):
-        o = ""
-        for i, t in enumerate(self):
-            o += "unset label {}\n".format(i+1)
-        return o
+        return self.fragment("unset label {}\n")
 
 
 class Line():
+    """ line properties of the series of a figure
+
+        unless given explicitly, series i uses point and dash type i+1
+        and the color of its entry in the color table, see color_table
+    """
+
+    __slots__ = ("exp_withs", "exp_line_types", "exp_line_color",
+                 "exp_line_width", "exp_dashtype", "exp_pointtype",
+                 "canvas")
 
     def __init__(self, canvas=None):
         self.exp_withs = [] # line or points
@@ -304,16 +499,19 @@ class Line():
         self.exp_line_width = None
         self.exp_dashtype = None
         self.exp_pointtype = None
-        self.ctr = self.gen()
         self.canvas = canvas
 
-    def get(self, i, palette):
+    def get(self, i, palette, color=None):
+        """ with clause of series i, color is its index in the color
+            table and defaults to i """
+        if self._prop("exp_withs", i) == "image":
+            return "w image"
         return "w {wt} pt {pt} dt {dt} lw {lw} {lc}".format(
                 wt=self._with(i, palette),
                 lw=self._line_width(i),
                 pt=self._pointtype(i),
                 dt=self._dashtype(i),
-                lc=self._color(i, palette))
+                lc=self._color(i, palette, i if color is None else color))
 
     def _prop(self, name, i):
         prop = getattr(self, name)
@@ -332,37 +530,14 @@ class Line():
     def _with(self, i, palette):
         return self._prop("exp_withs", i) + palette
 
-    def gen(self):
-        # l = []
-        # for i in range(40):
-        #      for _ in range(3):
-        #         l.append(i)
-        # for i in cycle(l):
-        #     yield i
-        # NOTE this counter is called several times per figure
-        # e.g. for line color, point and dash types
-         def init():
-             return 0
-         i = init()
-         while True:
-             for _ in range(3):
-                 val = (yield i)
-             if val=='restart':
-                 print("DEBUG gen reset")
-                 i = 0 # init()
-             else:
-                 # print("DEBUG ctr incr", i)
-                 i += 1
-
-    def _color(self, i, palette=False):
+    def _color(self, i, palette=False, index=None):
         if palette:
             return ""
         val = self.exp_line_color[i]  #False #self._prop("exp_color", i)
         colors = rcParams["colors"]
         num_cols = len(colors)
-        index = val
         if not val:
-            index = int(next(self.ctr)) % num_cols
+            index = (i if index is None else index) % num_cols
         elif isinstance(val, int):
             index = val
             val = False
@@ -374,15 +549,11 @@ class Line():
 
     def _dashtype(self, i):
         prop = self._prop("exp_dashtype", i)
-        index = int(next(self.ctr))
-        prop = prop if prop else str(index+ 1)
-        return prop
+        return prop if prop else str(i + 1)
 
     def _pointtype(self, i):
         prop = self._prop("exp_pointtype", i)
-        index = int(next(self.ctr))
-        prop = prop if prop else str(index + 1)
-        return prop
+        return prop if prop else str(i + 1)
 
     def append(self, lt, exp_color=False):
         self.exp_withs.append(lt)
@@ -396,9 +567,15 @@ class GnuplotFigure():
         self.rcParams = RcParams(kwargs.get("rcParams", dict()))
         self.svg = False
 
-        self.x = []
-        self.y = []
-        self.z = []
+        # columns of all series, see x, y and z
+        self.series = Series.SeriesStore()
+        # per series flag whether series may be decimated before emission
+        self.decimate = []
+        # per series token, series with the same token share their x
+        # column and are written into a single data block
+        self.groups = []
+        # cached finite extrema per series index, see series_extrema
+        self.extrema = {}
 
         self.canvas = kwargs.get("canvas", None)
 
@@ -439,27 +616,61 @@ class GnuplotFigure():
         self.pre_set = []
         self.post_set = []
 
-    def reset_ctr(self):
-        #TODO FIXME
-        # print("DEBUG ctr reset")
-        self.lt.ctr.send("restart")
+        # incremented whenever series or set commands are added
+        self.revision = 0
+        # multiplot reused for display, keeps track of rendered formats
+        self.mP = None
+        # cached pre_text and post_text, see fragment
+        self.fragments = {}
+        # last styler of each applied style chain to the chain and the
+        # revision it was applied to, see Style.CompiledStyle
+        self.styled = weakref.WeakKeyDictionary()
 
+    @property
+    def x(self):
+        return Series.SeriesAxis(self.series, Series.X)
+
+    @property
+    def y(self):
+        return Series.SeriesAxis(self.series, Series.Y)
+
+    @property
+    def z(self):
+        return Series.SeriesAxis(self.series, Series.Z)
 
     def insert(self, f2):
+        self.series.extend(f2.series)
         for i in range(len(f2.x)):
             self.legend.legends.append(f2.legend.legends[i])
-            self.x.append(f2.x[i])
-            self.y.append(f2.y[i])
-            self.z.append(f2.z[i])
             self.lt.append(f2.lt.exp_withs[i])
+            self.decimate.append(f2.decimate[i])
+            self.groups.append(f2.groups[i])
+        self.revision += 1
+        self.extrema = {}
         return self
 
-    def add(self, x, y, legend, lt, z=None, plotProperties=None):
+    def add(self, x, y, legend, lt, z=None, plotProperties=None,
+            decimate=True, group=None):
+        self.revision += 1
+        self.extrema = {}
         self.legend.legends.append(legend)
-        self.x.append(x)
-        self.y.append(y)
-        self.z.append(z)
+        self.series.append(x, y, z)
         self.lt.append(lt)
+        self.decimate.append(decimate)
+        self.groups.append(group)
+
+    def add_matrix(self, z, legend, x=None, y=None):
+        """ add a 2D array z of shape (len(y), len(x)) drawn with image,
+            x and y are the cell centres and default to the indices """
+        z = np.asarray(z)
+        if z.ndim != 2:
+            raise ValueError("matrix has to be 2D, got shape {}".format(z.shape))
+        x = np.arange(z.shape[1]) if x is None else np.asarray(x)
+        y = np.arange(z.shape[0]) if y is None else np.asarray(y)
+        if (len(y), len(x)) != z.shape:
+            raise ValueError("matrix of shape {} does not match {} x and {} y"
+                             .format(z.shape, len(x), len(y)))
+        self.add(x=x, y=y, z=z, legend=legend, lt="image", decimate=False)
 
     @property
     def vals(self):
@@ -468,43 +679,57 @@ class GnuplotFigure():
         else:
             return (self.x, self.y)
 
+    def series_extrema(self, i):
+        """ finite (xmin, xmax, ymin, ymax) of series i, cached until
+            series are added or inserted """
+        if i in self.extrema:
+            return self.extrema[i]
+        if self.lt.exp_withs[i] == "image":
+            # images cover half a cell beyond the outermost centres
+            self.extrema[i] = cell_range(self.x[i]) + cell_range(self.y[i])
+        else:
+            self.extrema[i] = finite_range(self.x[i]) + finite_range(self.y[i])
+        return self.extrema[i]
+
+    def data_range(self, offset):
+        """ range of the finite values of all series, [None, None] if
+            there are none """
+        bounds = [self.series_extrema(i)[offset:offset+2]
+                  for i in range(len(self.x))]
+        bounds = [b for b in bounds if b[0] is not None]
+        if not bounds:
+            return [None, None]
+        return [min(b[0] for b in bounds), max(b[1] for b in bounds)]
+
     @property
     def xrange(self):
-        if list(map(lambda x: x != None, self.x_range))[0]:
+        if self.x_range[0] is not None:
             return self.x_range
         else:
-            return [min([min(x) for x in self.x if len(x)]),
-                    max([max(x) for x in self.x if len(x)])]
+            return self.data_range(0)
 
     @property
     def yrange(self):
-        def valid_(y):
-            if y is None:
-                return False
-            else:
-                return len(y)
-
-        def min_(y):
-            try:
-                return min(y)
-            except:
-                print(y)
-                return False
-
-        def max_(y):
-            try:
-                return max(y)
-            except:
-                return False
-
-
-        if list(map(lambda x: x != None, self.y_range))[0]:
+        if self.y_range[0] is not None:
             return self.y_range
         else:
-            minys = [min_(y) for y in self.y]
-            maxys = [max_(y) for y in self.y]
-            return [min([y for y in minys if isinstance(y, NumberTypes)]),
-                    max([y for y in maxys if isinstance(y, NumberTypes)])]
+            return self.data_range(2)
+
+    def state(self):
+        """ cheap fingerprint of the figure, changes to the series are
+            tracked by the revision, all other properties by value """
+        def props(obj):
+            return sorted((k, repr(getattr(obj, k))) for k in obj.__slots__
+                          if k != "canvas")
+
+        return repr((
+            self.revision, len(self.x),
+            [props(p) for p in (self.x_label, self.x2_label, self.y_label,
+                                self.y2_label, self.size, self.grid,
+                                self.legend, self.lt)],
+            list(self.labels), self.x_range, self.x2_range, self.y_range,
+            self.y2_range, self.title, self.pre_set, self.post_set,
+            dict(self.rcParams)))
 
     def set(self, opts, undo=True):
         self.pre_set.append("set " + opts + "\n")
@@ -517,9 +742,24 @@ class GnuplotFigure():
             self.post_set.append("set " + opts + "\n")
 
 
+    def fragment(self, key, build, *args):
+        """ cached result of build(*args), rebuilt if any of the plot
+            properties, the set commands or the rcParams change """
+        props = (self.size, self.legend, self.x_label, self.x2_label,
+                 self.y_label, self.y2_label, self.grid)
+        stamp = (fragment_stamp(self.canvas),
+                 tuple(p.revision for p in props), tuple(self.labels),
+                 tuple(self.x_range), tuple(self.y_range),
+                 tuple(self.pre_set), tuple(self.post_set))
+        if self.fragments.get(key, (None,))[0] != stamp:
+            self.fragments[key] = (stamp, build(*args))
+        return self.fragments[key][1]
+
     def pre_text(self, svg):
         self.svg = svg
+        return self.fragment(("pre_text", svg), self._pre_text, svg)
 
+    def _pre_text(self, svg):
         # TODO use pre_set more extensivly
         pre_set = "".join(self.pre_set)
 
@@ -536,7 +776,14 @@ class GnuplotFigure():
                     self.grid.text,
                     pre_set])
 
-    def ftext(self, interOpts=None, finalOpts=None):
+    def ftext(self, interOpts=None, finalOpts=None, sources=None, colors=None):
+        """ returns the plot entries of all series, sources can map
+            a series index to a plot source replacing the inline data block,
+            colors the series to their color index, see color_table
+        """
+        sources = sources if sources else {}
+        if colors is None:
+            colors = color_table([("", self)])[""]
 
         def lt(arg):
             return ("lp" if arg == "line" else "p")
@@ -553,17 +800,25 @@ class GnuplotFigure():
         #            , self.rcParams['lw'], i+1)
         #            for i, _ in enumerate(self.x)]
 
-        entries = ["_{} title '{}' {} pi {}".format(
-                   i, self.legend[i], self.lt.get(i, palette(i)), dist(i))
-                   for i, _ in enumerate(self.x)]
+        def pi(i):
+            if self.lt.exp_withs[i] == "image":
+                return ""
+            return " pi {}".format(dist(i))
+
+        entries = [" {} title '{}' {}{}".format(
+                   sources.get(i, "${}_" + str(i)),
+                   self.legend[i], self.lt.get(i, palette(i), colors[i]), pi(i))
+                   for i in range(len(self.x))]
 
-        return [" ${}" + e for e in entries]
+        return entries
 
     def text(self):
-        self.reset_ctr()
         return GnuplotMultiplot([self], filename=self.filename).text()
 
     def post_text(self):
+        return self.fragment("post_text", self._post_text)
+
+    def _post_text(self):
         post_set = "".join(self.post_set)
         return "".join([
                     post_set,
@@ -578,16 +833,27 @@ class GnuplotFigure():
                     "\nunset ytics\n"])
 
     #def _repr_svg_(self):
-    #    self.reset_ctr()
     #    mP = GnuplotMultiplot([self], filename=self.filename)
     #    mP.write_file()
     #    return mP._repr_svg_()
 
+    def multiplot(self):
+        if not self.mP:
+            self.mP = GnuplotMultiplot([self], filename=self.filename)
+        return self.mP
+
+    def render(self, formats=None):
+        """ render the figure to formats not yet rendered for its state """
+        return self.multiplot().render(formats)
+
+    async def render_async(self, formats=None):
+        return await self.multiplot().render_async(formats)
+
     def _repr_png_(self):
-        self.reset_ctr()
-        mP = GnuplotMultiplot([self], filename=self.filename)
-        mP.write_file()
-        return mP._repr_png_()
+        return self.multiplot()._repr_png_()
+
+    def _repr_mimebundle_(self, include=None, exclude=None):
+        return self.multiplot()._repr_mimebundle_(include, exclude)
 
 
 class GnuplotScript():
@@ -597,14 +863,41 @@ class GnuplotScript():
         self.filename = (filename if filename else self.generateFilename())
         self.script = script
         self.svg=False
+        self.gnuplot_error = None
+        # Stats.RenderStats of the current render if enabled
+        self.stats = None
 
     def write_script_to_file(self, header, ext=".gp"):
+        self.write_chunks_to_file([header, self.script], ext)
+
+    def write_chunks_to_file(self, chunks, ext=".gp"):
+        """ write a script given as iterable of chunks without
+            assembling it in memory """
+        self.prepare_dir()
         with open(self.filename + ext, 'w+') as f:
-            f.write(header)
-            f.write(self.script)
+            for chunk in chunks:
+                with self.timer("write"):
+                    n = f.write(chunk)
+                if self.stats:
+                    self.stats.bytes_written += n
+
+    def timer(self, phase):
+        """ times the enclosed block as phase if stats are recorded """
+        return self.stats.timer(phase) if self.stats else nullcontext()
+
+    def gnuplot_timer(self, terminal):
+        """ times the enclosed gnuplot call if stats are recorded """
+        if not self.stats:
+            return nullcontext()
+        return self.stats.timer(terminal, self.stats.gnuplot)
 
     def generateFilename(self):
-        return "/tmp/SalviaPlot-" + str(time.time()).split('.')[0]
+        return workspace().filename()
+
+    def prepare_dir(self):
+        """ create the directory of filename on the first write, or again
+            if it has been removed by the workspace cleanup meanwhile """
+        workspace().prepare(self.filename)
 
     def change_terminal(self, terminal, file_ext):
         self.script = re.sub(
@@ -618,19 +911,129 @@ class GnuplotScript():
             self.script)
 
 
-    def call_gnuplot(self, svg=False, ext="_eps.gp"):
+    def call_gnuplot(self, svg=False, ext="_eps.gp", terminal=None):
+        """ run the script filename + ext, terminal names the rendered
+            formats in the stats and defaults to the one encoded in ext """
+        self.svg = svg
+        cmd = "{}".format(os.path.basename(self.filename)) + ext
+        cwd = os.path.dirname(self.filename)
+        if cwd == '':
+            cwd = './'
+        terminal = terminal if terminal else ext.strip("_").split(".")[0]
+        self.gnuplot_error = None
+        try:
+            with self.gnuplot_timer(terminal):
+                if rcParams['gnuplot_pool']:
+                    pool = Session.get_pool(
+                            rcParams['gnuplot_pool_size'], "gnuplot",
+                            rcParams['gnuplot_timeout'],
+                            rcParams['gnuplot_max_jobs'])
+                    self.gnuplot_output = pool.load(cmd, os.path.abspath(cwd))
+                else:
+                    self.gnuplot_output = subprocess.check_output(
+                            ["gnuplot", cmd], cwd=cwd, stderr=subprocess.PIPE)
+        except Exception as e:
+            self.gnuplot_error = e
+            print("cmd gnuplot {} in {} failed ".format(cmd,cwd))
+            print(e)
+
+    def pipe_gnuplot(self, chunks, terminal="pipe"):
+        """ feed a script given as iterable of chunks to a gnuplot process
+            and return everything it writes to stdout """
+        self.gnuplot_error = None
+        if self.stats:
+            chunks = self.stats.counted(chunks)
+        with self.gnuplot_timer(terminal):
+            out, err, returncode = self._pipe_gnuplot(chunks)
+        self.gnuplot_output = out
+        if returncode:
+            self.gnuplot_error = Session.GnuplotError(
+                    b"".join(err).decode(errors="replace"))
+            raise self.gnuplot_error
+        return out
+
+    def _pipe_gnuplot(self, chunks, cwd=None):
+        """ run gnuplot in cwd on a script given as iterable of chunks,
+            returns its stdout, the chunks of its stderr and its exit code """
+        proc = subprocess.Popen(["gnuplot"], cwd=cwd, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        err = []
+
+        def feed():
+            try:
+                for chunk in chunks:
+                    proc.stdin.write(chunk.encode("utf-8"))
+            except BrokenPipeError:
+                pass
+            finally:
+                proc.stdin.close()
+
+        # stdin and stderr are served by threads to avoid filling the pipes
+        threads = [threading.Thread(target=feed),
+                   threading.Thread(target=lambda: err.append(proc.stderr.read()))]
+        for t in threads:
+            t.start()
+        out = proc.stdout.read()
+        for t in threads:
+            t.join()
+        proc.wait()
+        return out, err, proc.returncode
+
+    async def call_gnuplot_async(self, svg=False, ext="_eps.gp", terminal=None):
+        """ awaitable call_gnuplot running gnuplot as asyncio subprocess """
         self.svg = svg
         cmd = "{}".format(os.path.basename(self.filename)) + ext
         cwd = os.path.dirname(self.filename)
         if cwd == '':
             cwd = './'
+        terminal = terminal if terminal else ext.strip("_").split(".")[0]
+        self.gnuplot_error = None
         try:
-            self.gnuplot_output = subprocess.check_output(["gnuplot", cmd],
-                    cwd=cwd, stderr=subprocess.PIPE)
+            with self.gnuplot_timer(terminal):
+                proc = await asyncio.create_subprocess_exec("gnuplot", cmd,
+                        cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                try:
+                    self.gnuplot_output, err = await asyncio.wait_for(
+                            proc.communicate(), rcParams['gnuplot_timeout'])
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+                    raise Session.GnuplotError("gnuplot timed out after {}s"
+                            .format(rcParams['gnuplot_timeout']))
+                if proc.returncode:
+                    raise Session.GnuplotError(err.decode(errors="replace"))
         except Exception as e:
+            self.gnuplot_error = e
             print("cmd gnuplot {} in {} failed ".format(cmd,cwd))
             print(e)
 
+    def stream_gnuplot(self, chunks, terminal="stream"):
+        """ feed a script given as iterable of chunks to gnuplot's stdin """
+        cwd = os.path.dirname(self.filename)
+        if cwd == '':
+            cwd = './'
+        self.gnuplot_error = None
+        if self.stats:
+            chunks = self.stats.counted(chunks)
+        try:
+            with self.gnuplot_timer(terminal):
+                if rcParams['gnuplot_pool']:
+                    pool = Session.get_pool(
+                            rcParams['gnuplot_pool_size'], "gnuplot",
+                            rcParams['gnuplot_timeout'],
+                            rcParams['gnuplot_max_jobs'])
+                    self.gnuplot_output = pool.stream(chunks, os.path.abspath(cwd))
+                else:
+                    out, err, returncode = self._pipe_gnuplot(chunks, cwd)
+                    self.gnuplot_output = out
+                    if returncode:
+                        raise Session.GnuplotError(
+                                b"".join(err).decode(errors="replace"))
+        except Exception as e:
+            self.gnuplot_error = e
+            print("streaming to gnuplot in {} failed ".format(cwd))
+            print(e)
+
     #def _repr_svg_(self):
     #    self.call_gnuplot(svg=True, ext="_svg.gp")
     #    print("Displaying file: {}{}".format(self.filename, ".svg"))
@@ -638,7 +1041,10 @@ class GnuplotScript():
 
     def _repr_png_(self):
         self.call_gnuplot(svg=True, ext="_png.gp")
-        fn = "{}{}".format(self.filename, ".png")
+        return self.read_png()
+
+    def read_png(self, fn=None):
+        fn = fn if fn else "{}{}".format(self.filename, ".png")
         print("Displaying file: " + fn)
         data = b2a_base64(open(fn, 'rb').read()).decode("ascii").replace("\n","")
         return data
@@ -671,23 +1077,40 @@ class GnuplotMultiplot(GnuplotScript):
 
         self.istransposed = kwargs.get("transposed", False)
         self.flat = kwargs.get("flattened", False)
+        # explicit (rows, cols) of the multiplot layout, used by tiles
+        self.layout = kwargs.get("layout", None)
+        # tiles of the last render_tiled and the tiling they belong to
+        self.tile_plots = []
+        self.tiling = None
 
         self.set_style = None
+        # paths of the files produced by the last write_file, keyed by format
+        self.outputs = {}
+        # files rendered for the state rendered_state, keyed by format
+        self.rendered = {}
+        self.rendered_bytes = {}
+        self.rendered_state = None
+        # set while rendering to bytes, forces inline data blocks
+        self.in_memory = False
+        # plot sources of all series, keyed by (pid, i)
+        self.sources = {}
+        # digests of the data files read by gnuplot, keyed by path
+        self.file_digests = {}
+        self.cache_keys = {}
+        # layout of the last memory mapped data file, see write_mapped_blocks
+        self.mapped_signature = None
         # TODO refactor this
         # set canvas references
         self.style = kwargs.get("style", False)
 
-    def reset_ctrs(self):
-        # TODO FIXME
-        for _, fig in self.data.items():
-            fig.reset_ctr()
-
     def set_canvas(self):
         for _, fig in self.data.items():
             setattr(fig, "canvas", self)
             for name in ["size", "x_label", "y_label", "y2_label", "legend", "lt"]:
                 attr = getattr(fig, name)
-                setattr(attr, "canvas", self)
+                # keeps the cached fragments of the property if unchanged
+                if attr.canvas is not self:
+                    setattr(attr, "canvas", self)
 
     def __getitem__(self, key):
         return self.data[key]
@@ -699,12 +1122,13 @@ class GnuplotMultiplot(GnuplotScript):
         return self.data.get(key, GnuplotFigure())
 
     def display(self, displ):
-        self.call_gnuplot(svg=True, ext="_png.gp")
-        fn = "{}{}".format(self.filename, ".png")
-        displ(fn)
+        self.render(["png"])
+        displ(self.output_path("png"))
 
     @property
     def n_sub_figs(self):
+        if self.layout:
+            return self.layout
         n_sub_figs = len(self.data.items())
         if not self.flat:
             x, y = (greatest_divisor(n_sub_figs),
@@ -782,45 +1206,387 @@ class GnuplotMultiplot(GnuplotScript):
 #        self.write_file()
 #        return super(GnuplotMultiplot, self)._repr_svg_()
 
+    @property
+    def is_tiled(self):
+        """ whether render uses render_tiled, see tile_rows """
+        tile_rows = self.rcParams['tile_rows']
+        return bool(tile_rows) and self.n_sub_figs[0] > tile_rows
+
     def _repr_png_(self):
         # TODO build a svg variant of the figure
-        self.write_file()
-        return super(GnuplotMultiplot, self)._repr_png_()
-
-
-    def write_file(self):
+        # tiled multiplots are displayed from the composited file
+        if self.rcParams['display_in_memory'] and not self.is_tiled:
+            return b2a_base64(self.render_bytes("png")).decode("ascii").replace("\n","")
+        self.render(["png"])
+        return self.read_png(self.output_path("png"))
+
+    def _repr_mimebundle_(self, include=None, exclude=None):
+        """ render only the mimetypes requested by the frontend """
+        types = [t for t in mimetypes if t in include] if include else [
+                 t for t in mimetypes if mimetypes[t] in self.rcParams['display_formats']]
+        types = [t for t in types if not exclude or t not in exclude]
+        if self.rcParams['display_in_memory'] and not self.is_tiled:
+            bundle = {}
+            for t in types:
+                data = self.render_bytes(mimetypes[t])
+                bundle[t] = (b2a_base64(data).decode("ascii").replace("\n","")
+                             if mimetypes[t] == "png" else data.decode("utf-8"))
+            return bundle
+        outputs = self.render([mimetypes[t] for t in types])
+        bundle = {}
+        for t in types:
+            fmt = mimetypes[t]
+            # tiled formats other than png are several pages, see render_tiled
+            if fmt not in outputs or isinstance(outputs[fmt], list):
+                continue
+            if fmt == "png":
+                bundle[t] = self.read_png(outputs[fmt])
+            else:
+                bundle[t] = open(outputs[fmt], 'r').read()
+        return bundle
+
+    def state(self):
+        """ fingerprint of the multiplot and all its figures """
+        return repr((
+            [(pid, f.state()) for pid, f in self.data.items()],
+            self.title, self.istransposed, self.flat, self.layout, self.set_style,
+            dict(self.rcParams), rcParams))
+
+    def render(self, formats=None):
+        """ render formats which have not been rendered for the current
+            state yet and return the paths of all requested formats """
+        formats = list(formats if formats else self.rcParams['formats'])
+        if self.is_tiled:
+            return self.render_tiled(formats)
+        missing = self.unrendered(formats)
+        if missing:
+            self.write_file(missing)
+            self.record_rendered()
+        return {f: self.rendered[f] for f in formats if f in self.rendered}
+
+    def tiles(self, tile_rows):
+        """ split the multiplot into multiplots of tile_rows full rows of
+            its layout each. Tiles are reused as long as the figures and
+            the tiling do not change, so that unchanged tiles are not
+            rendered again """
+        rows, cols = self.n_sub_figs
+        cols = int(cols)
+        per_tile = int(tile_rows) * cols
+        items = list(self.data.items())
+        tiling = (per_tile, cols, [(k, id(f)) for k, f in items],
+                  self.title, dict(self.rcParams))
+        if tiling == self.tiling:
+            return self.tile_plots
+        self.tiling = tiling
+        self.tile_plots = []
+        for n, start in enumerate(range(0, len(items), per_tile)):
+            tile = GnuplotMultiplot(
+                    OrderedDict(items[start:start + per_tile]),
+                    filename="{}_tile{}".format(self.filename, n),
+                    rcParams=dict(self.rcParams),
+                    layout=(int(tile_rows), cols))
+            tile.title = self.title if not n else False
+            self.tile_plots.append(tile)
+        return self.tile_plots
+
+    def render_tiled(self, formats=None, tile_rows=None, workers=None):
+        """ render the multiplot as tiles of tile_rows rows concurrently
+
+            png tiles are stacked into a single png by gnuplot, for all
+            other formats the list of tile files, one per page, is
+            returned. Formats which failed for any tile are left out and
+            the errors of the tiles are collected in gnuplot_error. The
+            style is applied to the whole multiplot before tiling so that
+            its slices refer to the full layout
+        """
+        formats = list(formats if formats else self.rcParams['formats'])
+        tile_rows = tile_rows if tile_rows else self.rcParams['tile_rows']
+        workers = workers if workers else rcParams['render_workers']
+        self.set_canvas()
+        if self.style:
+            self.style(self)
+        tiles = self.tiles(tile_rows)
+        states = [(t.rendered_state, list(t.rendered)) for t in tiles]
+        if rcParams['gnuplot_pool']:
+            Session.get_pool(
+                    rcParams['gnuplot_pool_size'], "gnuplot",
+                    rcParams['gnuplot_timeout'],
+                    rcParams['gnuplot_max_jobs']).grow(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = list(executor.map(lambda t: t.render(formats), tiles))
+
+        errors = ["tile {}: {}".format(n, t.gnuplot_error)
+                  for n, t in enumerate(tiles) if t.gnuplot_error]
+        self.outputs = {}
+        for fmt in formats:
+            if all(fmt in p for p in pages):
+                self.outputs[fmt] = [p[fmt] for p in pages]
+        self.gnuplot_error = None
+        if "png" in self.outputs:
+            changed = states != [(t.rendered_state, list(t.rendered))
+                                 for t in tiles]
+            if changed or not os.path.exists(self.output_path("png")):
+                self.composite(self.outputs["png"])
+            if self.gnuplot_error:
+                errors.append("composite: {}".format(self.gnuplot_error))
+                del self.outputs["png"]
+            else:
+                self.outputs["png"] = self.output_path("png")
+        if errors:
+            self.gnuplot_error = Session.GnuplotError("\n".join(errors))
+        return self.outputs
+
+    def composite(self, pngs):
+        """ stack png tiles vertically into filename.png """
+        width, height = self.compute_fig_size_px()
+        script = ("set terminal png size {}, {}\n".format(width, height*len(pngs))
+                  + "set output '{}.png'\n".format(os.path.basename(self.filename))
+                  + "set multiplot layout {}, 1 margins 0, 1, 0, 1 spacing 0, 0\n"
+                    .format(len(pngs))
+                  + "unset border\nunset tics\nunset key\nset autoscale fix\n")
+        for png in pngs:
+            script += "plot '{}' binary filetype=png with rgbalpha\n".format(
+                    os.path.basename(png))
+        script += "unset multiplot\nunset output\n"
+        self.write_chunks_to_file([script], "_composite.gp")
+        self.call_gnuplot(ext="_composite.gp", terminal="composite")
+
+    async def render_async(self, formats=None):
+        """ awaitable counterpart of render, concurrent renders of the
+            same multiplot are not supported """
+        formats = list(formats if formats else self.rcParams['formats'])
+        missing = self.unrendered(formats)
+        if missing:
+            await self.write_file_async(missing)
+            self.record_rendered()
+        return {f: self.rendered[f] for f in formats if f in self.rendered}
+
+    def unrendered(self, formats):
+        if self.state() != self.rendered_state:
+            self.rendered = {}
+            self.rendered_bytes = {}
+        # files might have been removed meanwhile, e.g. by the cleanup of
+        # the workspace
+        for fmt in list(self.rendered):
+            if not all(os.path.exists(p)
+                       for p in self.output_files(fmt).values()):
+                del self.rendered[fmt]
+        return [f for f in formats if f not in self.rendered]
+
+    def render_bytes(self, fmt):
+        """ to_bytes, reused as long as the state does not change """
+        if self.state() != self.rendered_state:
+            self.rendered = {}
+            self.rendered_bytes = {}
+        if fmt not in self.rendered_bytes:
+            self.rendered_bytes[fmt] = self.to_bytes(fmt)
+            self.rendered_state = self.state()
+        return self.rendered_bytes[fmt]
+
+    def to_bytes(self, fmt="png"):
+        """ render a single format without touching the disk, the script
+            including inline data blocks is fed to gnuplot's stdin and
+            the image is read from its stdout """
+        if fmt not in ("png", "svg"):
+            raise ValueError("cannot render {} to bytes".format(fmt))
+        self.prepare_file([fmt])
+
+        def chunks():
+            for chunk in self.iter_data_blocks(self.data):
+                yield chunk
+            yield self.target_text(fmt, stdout=True)
+
+        self.in_memory = True
+        try:
+            return self.pipe_gnuplot(chunks(), fmt)
+        finally:
+            self.in_memory = False
+            self.finish_stats()
+
+    def record_rendered(self):
+        if not self.gnuplot_error:
+            self.rendered.update(self.outputs)
+        self.rendered_state = self.state()
+
+    def prepare_file(self, formats):
+        """ apply canvas and style and reset the results of the last
+            write_file, returns the formats to render """
+        self.start_stats()
         self.set_canvas()
 
         # Style before write
         if self.style:
-            self.style(self)
+            with self.timer("style"):
+                self.style(self)
 
-        # Export to eps
-        x, y = self.compute_fig_size_cm()
-        fn = os.path.basename(self.filename)
-        opts = self.rcParams['eps_terminal_options']
-        self.script = self.text(svg=False)
-        self.write_script_to_file(self.header(".eps").format(x, y, opts, fn), "_eps.gp")
-        self.call_gnuplot()
-        self.reset_ctrs()
+        self.outputs = {}
+        self.gnuplot_error = None
+        return formats if formats else self.rcParams['formats']
 
-        # with open(self.filename + "-svg.gp", 'w+') as f:
+    def write_file(self, formats=None):
+        """ export the figure to the given formats, by default all formats
+            are rendered from a single script defining the data blocks once
+        """
+        formats = self.prepare_file(formats)
+        self.prepare_dir()
+        cache = render_cache()
+
+        if self.rcParams['multi_target']:
+            sections = self.plan_multi_target(formats, cache)
+            missing = list(sections)
+            if missing and self.rcParams['script_sink'] == 'pipe':
+                self.stream_gnuplot(self.iter_multi_target_text(sections),
+                                    ",".join(missing))
+            elif missing:
+                self.write_chunks_to_file(
+                        self.iter_multi_target_text(sections), ".gp")
+                self.call_gnuplot(svg=True, ext=".gp",
+                                  terminal=",".join(missing))
+            self.store_cached(cache, missing)
+        else:
+            for fmt in formats:
+                header, svg = self.target(fmt)
+                self.script = self.text(svg=svg)
+                key = self.data_key() if cache else ""
+                if not self.fetch_cached(cache, key, {fmt: header + self.script}):
+                    continue
+                self.write_script_to_file(header, "_{}.gp".format(fmt))
+                self.call_gnuplot(svg=svg, ext="_{}.gp".format(fmt))
+                self.store_cached(cache, [fmt])
+
+        for fmt in formats:
+            self.outputs[fmt] = self.output_path(fmt)
+        self.finish_stats()
+
+    def start_stats(self, reset=True):
+        """ start recording a new Stats.RenderStats if render_stats is set,
+            unless reset is False and stats are recorded already """
+        if not self.rcParams['render_stats']:
+            self.stats = None
+        elif reset or not self.stats:
+            self.stats = Stats.RenderStats(self.filename)
+
+    def finish_stats(self):
+        """ pass the recorded stats to stats_callback and stats_file """
+        if not self.stats:
+            return
+        self.stats.finish()
+        if self.rcParams['stats_callback']:
+            self.rcParams['stats_callback'](self, self.stats)
+        if self.rcParams['stats_file']:
+            self.stats.write(self.rcParams['stats_file'])
+
+    async def write_file_async(self, formats=None):
+        """ awaitable write_file, the script is generated in the default
+            executor of the event loop and gnuplot runs as asyncio
+            subprocess. Always renders from a single script file. """
+        loop = asyncio.get_running_loop()
+        cache = render_cache()
+        missing = []
+
+        def write_script():
+            fmts = self.prepare_file(formats)
+            self.prepare_dir()
+            sections = self.plan_multi_target(fmts, cache)
+            missing.extend(sections)
+            if missing:
+                self.write_chunks_to_file(
+                        self.iter_multi_target_text(sections), ".gp")
+            return fmts
+
+        formats = await loop.run_in_executor(None, write_script)
+        if missing:
+            await self.call_gnuplot_async(svg=True, ext=".gp",
+                                          terminal=",".join(missing))
+        await loop.run_in_executor(None, self.store_cached, cache, missing)
+
+        for fmt in formats:
+            self.outputs[fmt] = self.output_path(fmt)
+        self.finish_stats()
+
+    def plan_multi_target(self, formats, cache):
+        """ plan the data blocks and look up the script sections of the
+            formats in the cache, keyed by the content of the data before
+            anything is serialised. Returns the sections of the formats
+            which need to be rendered """
+        with self.timer("data"):
+            self.plan_data_blocks(self.data)
+        sections = OrderedDict((fmt, self.target_text(fmt)) for fmt in formats)
+        missing = self.fetch_cached(
+                cache, self.data_key() if cache else "", sections)
+        return OrderedDict((fmt, sections[fmt]) for fmt in missing)
+
+    def iter_multi_target_text(self, sections):
+        """ yields the multi target script of the planned data blocks,
+            data blocks first, then the given sections """
+        yield from self.iter_data_blocks(self.data, planned=True)
+        for section in sections.values():
+            yield section
+
+    def fetch_cached(self, cache, data_digest, sections):
+        """ copy cached renders of the script sections to their outputs
+            and return the formats which need to be rendered """
+        self.cache_keys = {}
+        if not cache:
+            return list(sections.keys())
         fn = os.path.basename(self.filename)
-        x, y = self.compute_fig_size_px()
-        opts = self.rcParams['svg_terminal_options']
-        self.script = self.text(svg=True)
-        self.write_script_to_file(self.header(".svg").format(x, y, opts, fn), "_svg.gp")
-        self.call_gnuplot(svg=True)
-        self.reset_ctrs()
-
-        # Export to png
+        missing = []
+        for fmt, section in sections.items():
+            # quoted output and data file names must not change the key,
+            # except for eps since the tex file of epslatex includes the
+            # eps by its name
+            if fmt != "eps":
+                section = section.replace("'" + fn, "'")
+            key = cache.key(section, [data_digest])
+            self.cache_keys[fmt] = key
+            if not cache.fetch(key, self.output_files(fmt)):
+                missing.append(fmt)
+        return missing
+
+    def store_cached(self, cache, formats):
+        if not cache or self.gnuplot_error:
+            return
+        for fmt in formats:
+            cache.store(self.cache_keys[fmt], self.output_files(fmt))
+
+    def target(self, fmt, stdout=False):
+        """ returns the terminal header and svg flag of an output format,
+            if stdout is set the output is not redirected to a file """
         fn = os.path.basename(self.filename)
-        x, y = self.compute_fig_size_px()
-        opts = self.rcParams['png_terminal_options']
-        self.script = self.text(svg=True)
-        self.write_script_to_file(self.header(".png").format(x, y, opts, fn), "_png.gp")
-        self.call_gnuplot(svg=True)
-        self.reset_ctrs()
+        opts = self.rcParams[fmt + '_terminal_options']
+        if fmt == "eps":
+            x, y = self.compute_fig_size_cm()
+        else:
+            x, y = self.compute_fig_size_px()
+        header = self.header("." + fmt).format(x, y, opts, fn)
+        if stdout:
+            header = header.split("\n")[0] + "\n"
+        return header, fmt != "eps"
+
+    def output_files(self, fmt):
+        """ files written by gnuplot for a format, keyed by suffix """
+        if fmt == "eps":
+            # epslatex writes the text into a separate tex file
+            suffixes = ["_eps.eps", "_eps.tex"]
+        else:
+            suffixes = ["." + fmt]
+        return OrderedDict((s, self.filename + s) for s in suffixes)
+
+    def output_path(self, fmt):
+        return list(self.output_files(fmt).values())[0]
+
+    def target_text(self, fmt, stdout=False):
+        """ script section rendering the multiplot to a single format,
+            starts with a reset which keeps the data blocks, so that no
+            settings leak from the sections of other formats """
+        header, svg = self.target(fmt, stdout)
+        return "reset\n" + header + self.body_text(svg) + "\nunset output\n"
+
+    def multi_target_text(self, formats):
+        """ script rendering all formats in one pass, data blocks are
+            written once and shared by all terminals """
+        return "".join(self.iter_multi_target_text(
+                self.plan_multi_target(formats, None)))
 
     def compute_fig_size_px(self):
         """
@@ -875,6 +1641,17 @@ class GnuplotMultiplot(GnuplotScript):
             return "set terminal epslatex size {}cm, {}cm {}\nset out '{}_eps.eps'\n"
 
     def text(self, svg=False):
+        self.start_stats(reset=False)
+        data_blocks, invalids = self.str_inline_data_blocks(self.data)
+        return data_blocks + self.body_text(svg)
+
+    def body_text(self, svg=False):
+        """ multiplot commands without the data blocks """
+        with self.timer("body"):
+            return "".join(self.iter_body_text(svg))
+
+    def iter_body_text(self, svg=False):
+        """ yields the multiplot commands subplot by subplot """
         data = self.data
         n_sub_figs = self.n_sub_figs
         body = ""
@@ -909,61 +1686,359 @@ class GnuplotMultiplot(GnuplotScript):
                 self.rcParams['border'],
                 self.rcParams['lw']
             ))
+        yield body
 
-        data_blocks, invalids = self.str_inline_data_blocks(data)
-        body += data_blocks
-
+        colors = color_table(data.items())
         for pid, d in data.items():
+            colors_ = colors[pid]
             pid = pid.replace("(", "").replace(")", "")
+            body = ""
+
+            with self.timer("ranges"):
+                xrange, yrange = d.xrange, d.yrange
+            # without finite data gnuplot autoscales the axes
+            if xrange[0] is not None:
+                body += ("\nset xrange [{:.4g}: {:.4g}]\n"
+                            .format(xrange[0], xrange[1]))
+            else:
+                body += "\nset autoscale x\n"
+            if yrange[0] is not None:
+                body += ("\nset yrange [{:.4g}: {:.4g}]\n"
+                            .format(yrange[0], yrange[1]))
 
-            body += ("\nset xrange [{:.4g}: {:.4g}]\n"
-                        .format(d.xrange[0], d.xrange[1]))
-            body += ("\nset yrange [{:.4g}: {:.4g}]\n"
-                        .format(d.yrange[0], d.yrange[1]))
-
-            body += ("\nset y2range [{:.4g}: {:.4g}]\n"
-                        .format(d.yrange[0], d.yrange[1]))
+                body += ("\nset y2range [{:.4g}: {:.4g}]\n"
+                            .format(yrange[0], yrange[1]))
+            else:
+                body += "\nset autoscale y\nset autoscale y2\n"
 
             body += d.pre_text(svg)
+            seps = set(y.source.sep for y in d.y
+                       if isinstance(y, FileColumn) and y.source.sep)
+            for sep in seps:
+                body += "set datafile separator \"{}\"\n".format(sep)
             body += "\nplot "
 
-            data_blocks = [e.format(pid) for e in d.ftext()]
+            sources = {i: src for (p, i), src in self.sources.items()
+                       if p == pid}
+            data_blocks = [e.format(pid)
+                           for e in d.ftext(sources=sources, colors=colors_)]
             s = ("".join(intersperse(", \\\n", data_blocks)))
             body += s
 
+            if seps:
+                body += "\nset datafile separator whitespace\n"
             body += d.post_text()
+            yield body
+
+        yield "\nunset multiplot"
+
+    @property
+    def decimation_buckets(self):
+        """ number of pixel columns available to a single subplot of the
+            rendered canvas """
+        cols = self.n_sub_figs[1]
+        return max(int(self.compute_fig_size_px()[0] / cols), 1)
+
+    def use_decimation(self, figure, i, x, z):
+        """ only line series with monotonic x and more points than the
+            envelope of the available pixel columns are decimated """
+        if (not self.rcParams["decimate"]
+                or not figure.decimate[i]
+                or figure.lt.exp_withs[i] not in ("line", "quad")
+                or not isinstance(z, type(None))
+                or isinstance(x, tuple)
+                or len(x) <= 4*self.decimation_buckets):
+            return False
+        try:
+            return bool(np.all(np.diff(x) >= 0))
+        except TypeError:
+            return False
+
+    def use_binary(self, n_points):
+        """ decide whether a series of n_points is written as binary file """
+        transport = self.rcParams["data_transport"]
+        if self.in_memory:
+            return False
+        if transport == "binary":
+            return True
+        if transport == "auto":
+            return n_points >= self.rcParams["binary_min_points"]
+        return False
 
-        body += "\nunset multiplot"
-        return body
+    def binary_source(self, name, n_cols):
+        """ gnuplot plot source of a data block written by write_binary_block """
+        fn = "{}_{}.bin".format(self.filename, name)
+        fmt = "%float64" * n_cols
+        return "'{}' binary format=\"{}\"".format(os.path.basename(fn), fmt)
+
+    def write_binary_block(self, name, cols):
+        """ write columns of a data block as interleaved float64 records
+            and return the corresponding gnuplot plot source """
+        fn = "{}_{}.bin".format(self.filename, name)
+        buf = np.empty((len(cols[0]), len(cols)), dtype=np.float64)
+        for j, col in enumerate(cols):
+            buf[:, j] = col
+        buf.tofile(fn)
+        return self.binary_source(name, len(cols))
 
     def str_inline_data_blocks(self, data):
-        """  write data directly into  gnuplot script and mark invalids"""
-        # TODO Move to gnuplot figure
-        invalids = {}
-        ret = ""
+        """  write data directly into  gnuplot script and mark invalids
+
+             series exceeding binary_min_points are written to separate
+             binary files instead, see data_transport
+        """
+        self.start_stats(reset=False)
+        ret = "".join(self.iter_data_blocks(data))
+        return ret, self.invalids
+
+    def collect_data_blocks(self, data):
+        """ group the columns of all valid series into data blocks
+
+            series of the same group, see GnuplotFigure.add, and series
+            with identical x columns share a block in which every
+            distinct column is stored once, see dedupe_data. Returns an
+            OrderedDict of block name to columns and stores the block
+            name and column numbers of each series in self.series_columns
+        """
+        self.invalids = {}
+        self.series_columns = {}
+        self.file_sources = {}
+        self.matrices = OrderedDict()
+        dedupe = self.rcParams["dedupe_data"]
+        blocks = OrderedDict()
+        block_keys = {}
+        by_x = {}
+        by_group = {}
+        memo = {}
         for pid, d in data.items():
+            pid_ = pid.replace("(", "").replace(")", "")
             for i, vals in enumerate(zip(d.x, d.y, d.z)):
                 try:
                     x = vals[0]
                     y = vals[1]
                     z = vals[2]
-                    x_ = (x if isinstance(x, tuple) else x.values)
-                    y_ = y.values
+                    tokens = [d.x.token(i), d.y.token(i), d.z.token(i)]
+                    if np.ndim(z) == 2:
+                        # written as matrix, see iter_matrix_block
+                        if not z.size:
+                            self.invalids[pid, i] = True
+                            continue
+                        self.matrices[pid_, i] = (x, y, z)
+                        continue
+                    if isinstance(y, FileColumn):
+                        # read by gnuplot directly
+                        self.file_sources[pid_, i] = y.source.plot_source(x, y, z)
+                        self.file_digests[y.source.path] = y.source.digest()
+                        continue
+                    x_ = (x if isinstance(x, tuple) else np.asarray(x))
+                    y_ = np.asarray(y)
                     if not len(y_):
-                        invalids[pid, i] = True
+                        self.invalids[pid, i] = True
                         continue
-                    pid = pid.replace("(", "").replace(")", "")
-                    ret += "${}_{} << EOD\n".format(pid, i)
-                    for j in range(len(y)):
-                        if isinstance(z, type(None)) :
-                            ret += "{} {}\n".format(x_[j], y_[j])
-                        else:
-                            ret += "{} {} {}\n".format(x_[j], y_[j], z.values[j])
-                    ret += "EOD\n"
+                    cols = [x_, y_]
+                    if not isinstance(z, type(None)):
+                        cols.append(np.asarray(z))
+                    group = d.groups[i]
+                    if self.use_decimation(d, i, x_, z):
+                        idx = decimate_indices(x_, y_, self.decimation_buckets)
+                        cols = [x_[idx], y_[idx]]
+                        tokens = [None, None]
+                        group = None
+                    keys = [column_key(c, t, memo, dedupe)
+                            for c, t in zip(cols, tokens)]
+                    name = "{}_{}".format(pid_, i)
+                    shareable = all(len(c) == len(cols[0]) for c in cols)
+                    if shareable and group is not None and group in by_group:
+                        name = by_group[group]
+                    elif shareable and dedupe and keys[0] in by_x:
+                        name = by_x[keys[0]]
+                    elif shareable:
+                        if group is not None:
+                            by_group[group] = name
+                        if dedupe:
+                            by_x[keys[0]] = name
+                    if name not in blocks:
+                        blocks[name] = []
+                        block_keys[name] = {}
+                    numbers = []
+                    for c, k in zip(cols, keys):
+                        if k not in block_keys[name]:
+                            blocks[name].append(c)
+                            block_keys[name][k] = len(blocks[name])
+                        numbers.append(block_keys[name][k])
+                    self.series_columns[pid_, i] = (name, numbers)
                 except Exception as e:
                     print(e, z)
-                    invalids[pid, i] = True
-        return ret, invalids
+                    self.invalids[pid, i] = True
+        self.block_keys = block_keys
+        return blocks
+
+    def mapped_layout(self, blocks):
+        """ (layout, offsets, signature) of the data blocks in the memory
+            mapped file, the signature identifies the content of the file
+            and is None if the columns are not keyed by content """
+        keys = [tuple(sorted(self.block_keys[name], key=self.block_keys[name].get))
+                for name in blocks]
+        layout = [(name, len(cols[0]), len(cols)) for name, cols in blocks.items()]
+        content = all(k[0] != "id" for ks in keys for k in ks)
+        signature = repr((layout, keys)) if content else None
+        offsets = np.cumsum([0] + [n*k for _, n, k in layout])
+        return layout, offsets, signature
+
+    def mapped_sources(self, blocks):
+        """ plot sources of the data blocks in the memory mapped file """
+        fn = self.filename + "_data.bin"
+        layout, offsets, _ = self.mapped_layout(blocks)
+        return {name: "'{}' binary skip={} record={} format=\"{}\"".format(
+                    os.path.basename(fn), off*8, n, "%float64"*k)
+                for off, (name, n, k) in zip(offsets, layout)}
+
+    def write_mapped_blocks(self, blocks):
+        """ write all data blocks as contiguous regions of interleaved
+            float64 records into a single memory mapped file, see
+            mapped_sources
+
+            the file is reused if all columns are keyed by content and
+            did not change since the last call
+        """
+        fn = self.filename + "_data.bin"
+        layout, offsets, signature = self.mapped_layout(blocks)
+        reuse = (signature and signature == self.mapped_signature
+                 and os.path.exists(fn))
+
+        if not reuse and blocks:
+            buf = np.memmap(fn, dtype=np.float64, mode='w+', shape=(offsets[-1],))
+            for off, (name, cols) in zip(offsets, blocks.items()):
+                region = buf[off:off + len(cols[0])*len(cols)].reshape(-1, len(cols))
+                for j, col in enumerate(cols):
+                    region[:, j] = col
+            buf.flush()
+            del buf
+        self.mapped_signature = signature
+
+    def iter_data_blocks(self, data, planned=False):
+        """ yields the inline data blocks in chunks of at most
+            stream_chunk_rows lines and writes the binary ones, invalid
+            series are collected in self.invalids. Unless planned is set
+            the blocks are planned first, see plan_data_blocks
+        """
+        if not planned:
+            self.plan_data_blocks(data)
+        chunks = self._iter_data_blocks()
+        return self.stats.timed("data", chunks) if self.stats else chunks
+
+    def plan_data_blocks(self, data):
+        """ group the series into data blocks and set the plot sources of
+            all series in self.sources without serialising any data """
+        self.sources = {}
+        self.file_digests = {}
+        blocks = self.collect_data_blocks(data)
+        if self.stats:
+            for key, (name, _) in self.series_columns.items():
+                self.stats.points[key] = len(blocks[name][0])
+        self.mapped = (self.rcParams["data_transport"] == "mmap"
+                       and not self.in_memory)
+        if self.mapped:
+            block_sources = self.mapped_sources(blocks)
+        else:
+            block_sources = OrderedDict(
+                    (name, self.binary_source(name, len(cols))
+                     if self.use_binary(len(cols[0])) else "$" + name)
+                    for name, cols in blocks.items())
+        for key, (name, numbers) in self.series_columns.items():
+            self.sources[key] = "{} using {}".format(
+                    block_sources[name], ":".join(map(str, numbers)))
+        self.sources.update(self.file_sources)
+        for key, (x, y, z) in self.matrices.items():
+            name = "{}_{}".format(*key)
+            if self.stats:
+                self.stats.points[key] = z.size
+            if self.use_binary(z.size) or self.mapped:
+                self.sources[key] = self.matrix_source(name, x, y, z)
+            else:
+                self.sources[key] = "${} nonuniform matrix".format(name)
+        self.blocks = blocks
+        self.block_sources = block_sources
+
+    def data_key(self):
+        """ content key of the planned data blocks, matrices and data
+            files, computed from the column buffers instead of their
+            serialised text """
+        parts = []
+        for name, cols in self.blocks.items():
+            keys = sorted(self.block_keys[name], key=self.block_keys[name].get)
+            parts.append((name, [k if k[0] != "id" else content_key(c)
+                                 for k, c in zip(keys, cols)]))
+        for key, (x, y, z) in self.matrices.items():
+            parts.append((key, np.shape(z),
+                          [content_key(c) for c in (x, y, z)]))
+        parts.append(sorted(self.file_digests.items()))
+        return Cache.RenderCache.key(repr(parts))
+
+    def _iter_data_blocks(self):
+        rows = self.rcParams["stream_chunk_rows"]
+        blocks = self.blocks
+        if self.mapped:
+            self.write_mapped_blocks(blocks)
+            blocks = {}
+        for name, cols in blocks.items():
+            if self.block_sources[name] != "$" + name:
+                self.write_binary_block(name, cols)
+                continue
+            line = " ".join("{}" for _ in cols) + "\n"
+            chunk = "${} << EOD\n".format(name)
+            for j in range(0, len(cols[0]), rows):
+                chunk += "".join(line.format(*r)
+                        for r in zip(*[c[j:j+rows] for c in cols]))
+                yield chunk
+                chunk = ""
+            yield "EOD\n"
+        for key, (x, y, z) in self.matrices.items():
+            name = "{}_{}".format(*key)
+            if self.sources[key].startswith("$"):
+                yield from self.iter_matrix_block(name, x, y, z)
+            else:
+                self.write_matrix_block(name, x, y, z)
+
+    def matrix_source(self, name, x, y, z):
+        """ plot source of a matrix written by write_matrix_block, matrices
+            on uniform grids are written as plain float64 array and placed
+            by origin and cell sizes, all others as float32 binary matrix
+            carrying the x and y coordinates """
+        fn = os.path.basename("{}_{}.bin".format(self.filename, name))
+        dx, dy = uniform_step(x), uniform_step(y)
+        if dx is None or dy is None:
+            return "'{}' binary matrix".format(fn)
+        return ("'{}' binary array=({},{}) format=\"%float64\" "
+                "origin=({!r},{!r}) dx={!r} dy={!r}").format(
+                fn, z.shape[1], z.shape[0], float(x[0]), float(y[0]), dx, dy)
+
+    def write_matrix_block(self, name, x, y, z):
+        """ dump a matrix to a binary file and return its plot source,
+            see matrix_source """
+        fn = "{}_{}.bin".format(self.filename, name)
+        if uniform_step(x) is not None and uniform_step(y) is not None:
+            buf = np.ascontiguousarray(z, dtype=np.float64)
+        else:
+            buf = np.empty((z.shape[0] + 1, z.shape[1] + 1), dtype=np.float32)
+            buf[0, 0] = z.shape[1]
+            buf[0, 1:] = x
+            buf[1:, 0] = y
+            buf[1:, 1:] = z
+        buf.tofile(fn)
+        return self.matrix_source(name, x, y, z)
+
+    def iter_matrix_block(self, name, x, y, z):
+        """ yields a matrix as inline nonuniform matrix data block """
+        rows = max(self.rcParams["stream_chunk_rows"] // z.shape[1], 1)
+        line = " ".join("{}" for _ in range(z.shape[1] + 1)) + "\n"
+        chunk = "${} << EOD\n".format(name) + line.format(z.shape[1], *x)
+        for j in range(0, z.shape[0], rows):
+            chunk += "".join(line.format(yj, *zj)
+                             for yj, zj in zip(y[j:j+rows], z[j:j+rows]))
+            yield chunk
+            chunk = ""
+        yield "EOD\n"
 
 
     # def _repr_svg_(self):
@@ -974,14 +2049,210 @@ class GnuplotMultiplot(GnuplotScript):
 # https://www2.uni-hamburg.de/Wiss/FB/15/Sustainability/schneider/gnuplot/colors.htm
 colored = rcParams['colors']
 
+class RenderResult():
+    """ outcome of rendering a single figure with render_many """
+
+    def __init__(self, figure, outputs=None, error=None):
+        self.figure = figure
+        self.outputs = outputs if outputs else {}
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "RenderResult({}, error={})".format(self.outputs, self.error)
+
+
+def _render(figure, formats):
+    mP = (figure if isinstance(figure, GnuplotMultiplot)
+          else GnuplotMultiplot([figure], filename=figure.filename))
+    try:
+        mP.write_file(formats)
+    except Exception as e:
+        return RenderResult(figure, error=e)
+    return RenderResult(figure, mP.outputs, mP.gnuplot_error)
+
+
+def render_many(multiplots, formats=None, workers=None, wait=True):
+    """ render a list of GnuplotMultiplots or GnuplotFigures concurrently
+
+        returns a RenderResult per figure in input order, or the
+        corresponding futures if wait is False. A figure must not be
+        part of several multiplots rendered at the same time.
+    """
+    workers = workers if workers else rcParams['render_workers']
+    if rcParams['gnuplot_pool']:
+        Session.get_pool(
+                rcParams['gnuplot_pool_size'], "gnuplot",
+                rcParams['gnuplot_timeout'],
+                rcParams['gnuplot_max_jobs']).grow(workers)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(_render, m, formats) for m in multiplots]
+    executor.shutdown(wait=wait)
+    if not wait:
+        return futures
+    return [f.result() for f in futures]
+
+
+def render_cache():
+    """ returns the render cache configured in rcParams if enabled """
+    if not rcParams['render_cache']:
+        return None
+    return Cache.RenderCache(
+            rcParams['render_cache_dir'],
+            rcParams['render_cache_max_bytes'],
+            rcParams['render_cache_max_age'])
+
+
+def invalidate_cache(key=None):
+    """ remove a single entry or all entries from the render cache """
+    cache = render_cache()
+    if cache:
+        cache.invalidate(key)
+
+
+_workspace = None
+_workspace_lock = threading.Lock()
+
+
+def workspace():
+    """ returns the shared render workspace configured in rcParams """
+    global _workspace
+    with _workspace_lock:
+        root = rcParams['workspace_root']
+        if not _workspace or _workspace.root != root:
+            _workspace = Workspace.Workspace(root)
+        _workspace.max_bytes = rcParams['workspace_max_bytes']
+        _workspace.max_age = rcParams['workspace_max_age']
+        _workspace.min_age = rcParams['workspace_min_age']
+        return _workspace
+
+
+def cleanup_workspace():
+    """ apply the retention policy of the render workspace now """
+    workspace().cleanup()
+
+
+def finite_range(values):
+    """ (min, max) of the finite values, (None, None) if there are none """
+    if values is None:
+        return (None, None)
+    if isinstance(values, FileColumn):
+        return values.range()
+    try:
+        v = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return (None, None)
+    v = v[np.isfinite(v)]
+    if not len(v):
+        return (None, None)
+    return (float(v.min()), float(v.max()))
+
+
+def cell_range(centres):
+    """ (min, max) of the cells around the finite centres of an image,
+        the outer cells extend half their spacing beyond the centres """
+    try:
+        v = np.asarray(centres, dtype=np.float64)
+    except (TypeError, ValueError):
+        return (None, None)
+    v = np.sort(v[np.isfinite(v)])
+    if not len(v):
+        return (None, None)
+    first, last = (v[1] - v[0], v[-1] - v[-2]) if len(v) > 1 else (1.0, 1.0)
+    return (float(v[0] - first/2), float(v[-1] + last/2))
+
+
+def column_key(col, token=None, memo=None, content=True):
+    """ content key of a data column, columns which cannot be hashed by
+        content or if content is False are keyed by identity. memo
+        caches the keys of the stored columns given by token, see
+        Series.SeriesStore.token """
+    if memo is not None and token is not None and token in memo:
+        return memo[token]
+    try:
+        if not content:
+            raise TypeError
+        arr = np.ascontiguousarray(col)
+        if arr.dtype.kind not in "biuf":
+            raise TypeError
+        key = (arr.dtype.str, len(arr), hashlib.sha1(arr).hexdigest())
+    except (TypeError, ValueError):
+        key = ("id", token if token is not None else id(col))
+    if memo is not None and token is not None:
+        memo[token] = key
+    return key
+
+
+def content_key(col):
+    """ key of a column by its content, columns which cannot be hashed as
+        buffer are keyed by their repr """
+    key = column_key(col)
+    if key[0] != "id":
+        return key
+    return ("repr", hashlib.sha1(repr(col).encode("utf-8")).hexdigest())
+
+
+def color_table(figures):
+    """ color index of every series of the (pid, figure) pairs, keyed by
+        pid. Series with the same legend share a color, unnamed series
+        get a color of their own, colors are assigned in series order """
+    table = {}
+    ret = OrderedDict()
+    for pid, f in figures:
+        ret[pid] = []
+        for i, name in enumerate(f.legend.legends):
+            key = name if name and name != "None" else (pid, i)
+            ret[pid].append(table.setdefault(key, len(table)))
+    return ret
+
+
+def uniform_step(values):
+    """ spacing of equally spaced values, None if they are not """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return 1.0
+    steps = np.diff(values)
+    if not np.allclose(steps, steps[0], rtol=1e-9, atol=0) or not steps[0]:
+        return None
+    return float(steps[0])
+
+
+def decimate_indices(x, y, buckets):
+    """ indices of the first, last, minimum and maximum sample of y in
+        each of buckets equally wide ranges of the monotonic x, the
+        resulting min/max envelope renders like the full series at one
+        bucket per pixel column. Empty buckets are skipped
+    """
+    y = np.asarray(y)
+    n = len(y)
+    edges = np.searchsorted(x, np.linspace(x[0], x[-1], buckets + 1)[1:-1])
+    starts = np.unique(np.concatenate(([0], edges)))
+    starts = starts[starts < n]
+    lengths = np.diff(np.append(starts, n))
+    idx = [starts, starts + lengths - 1]
+    for reduce in (np.fmin, np.fmax):
+        extreme = np.repeat(reduce.reduceat(y, starts), lengths)
+        hits = np.flatnonzero(y == extreme)
+        bucket = np.searchsorted(starts, hits, side="right") - 1
+        idx.append(hits[np.unique(bucket, return_index=True)[1]])
+    return np.unique(np.concatenate(idx))
+
+
 def greatest_divisor(number):
-    if number == 1:
+    """ greatest divisor of number smaller than number, 1 for primes """
+    if number <= 1:
         return 1
-    for i in reversed(range(number)):
+    # the greatest divisor belongs to the smallest prime factor
+    i = 2
+    while i * i <= number:
         if number % i == 0:
-            return i
-    else:
-        return 1
+            return number // i
+        i += 1
+    return 1
 
 intersperse = lambda e, l: sum([[x, e] for x in l], [])[:-1]
 
@@ -1008,6 +2279,72 @@ class PlotProperties():
             return field.get(prop, default)
 
 
+class FileSource():
+    """ delimited text file with a header line which is read by gnuplot
+        directly instead of being loaded and written into the script.
+        Columns are resolved by name from the header, sep=None denotes
+        whitespace separated files. Subplots mixing in-memory series
+        and files need whitespace separated files.
+    """
+
+    def __init__(self, path, sep=","):
+        self.path = os.path.abspath(path)
+        self.sep = sep
+        with open(self.path, 'r') as f:
+            header = f.readline()
+        self.columns = [c.strip() for c in header.strip().split(sep)]
+        self.ranges = {}
+
+    def __getitem__(self, name):
+        return FileColumn(self, name)
+
+    def index(self, name):
+        return self.columns.index(name)
+
+    def digest(self):
+        """ changes whenever the file is modified """
+        st = os.stat(self.path)
+        return "{}-{}".format(st.st_size, st.st_mtime_ns)
+
+    def plot_source(self, x, y, z=None):
+        cols = [c for c in (x, y, z) if c is not None]
+        using = ":".join(str(self.index(c.name) + 1) for c in cols)
+        path = self.path.replace("{", "{{").replace("}", "}}")
+        return "'{}' skip 1 using {}".format(path, using)
+
+    def range(self, name):
+        """ finite (min, max) of a column, scanned in chunks of
+            file_scan_chunk_rows rows and cached per file version """
+        key = (name, self.digest())
+        if key not in self.ranges:
+            import pandas as pd
+            lower, upper = None, None
+            chunks = pd.read_csv(
+                    self.path, sep=self.sep if self.sep else r"\s+",
+                    usecols=[self.index(name)],
+                    chunksize=rcParams["file_scan_chunk_rows"])
+            for chunk in chunks:
+                l, u = finite_range(
+                    pd.to_numeric(chunk.iloc[:, 0], errors="coerce").values)
+                if l is None:
+                    continue
+                lower = l if lower is None else min(lower, l)
+                upper = u if upper is None else max(upper, u)
+            self.ranges[key] = (lower, upper)
+        return self.ranges[key]
+
+
+class FileColumn():
+    """ reference to a named column of a FileSource """
+
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+
+    def range(self):
+        return self.source.range(self.name)
+
+
 class Props():
     # TODO default args
 
@@ -1025,14 +2362,21 @@ def draw(x, y, data, title=None, func="line",
         names=None, **kwargs):
     """ draws a figure from x and y label and a dataframe
         if figure is given dataset will be drawn into existing figure
+        data can also be a FileSource or the path of a csv file
     """
     pP = kwargs.get('properties', Props())
 
     figure = figure if figure else GnuplotFigure(filename=kwargs.get("filename", None))
     y = (y if isinstance(y, list) else [y])
+    if isinstance(data, str):
+        data = FileSource(data, kwargs.get("sep", ","))
+    # series of a single call share their x column and thus a data block
+    group = object() if kwargs.get("columnar", rcParams["columnar"]) else None
+    x_data = data[x]
+    z_data = data[z] if z else z
+    figure.series.reserve([x_data, z_data] + [data[yi] for yi in y])
     for yi in y:
-        x_data, y_data = data[x], data[yi]
-        z = data[z] if z else z
+        y_data = data[yi]
 
         # First check explicitly specified name
         name = kwargs.get("name", None)
@@ -1045,9 +2389,10 @@ def draw(x, y, data, title=None, func="line",
             name = "None"
 
         figure.add(
-                x=x_data, y=y_data, z=z,
+                x=x_data, y=y_data, z=z_data,
                 legend=legend_prefix + name,
-                lt=func)
+                lt=func, decimate=kwargs.get("decimate", True),
+                group=group)
 
     # # set axis ranges and labels
     for ax, data_set in {'x': x, 'y': y[0]}.items():
@@ -1066,6 +2411,19 @@ def draw(x, y, data, title=None, func="line",
     return figure
 
 
+def heatmap(z, x=None, y=None, figure=None, legend="", **kwargs):
+    """ draws a 2D array z of shape (len(y), len(x)) with image, the
+        matrix is passed to gnuplot as binary file, see add_matrix
+    """
+    figure = figure if figure else GnuplotFigure(filename=kwargs.get("filename", None))
+    figure.add_matrix(z, legend, x, y)
+    for ax in ("x", "y"):
+        label = kwargs.get(ax + "_label")
+        if label:
+            getattr(figure, ax + "_label").name = label
+    return figure
+
+
 def _range(axis, field, properties, **kwargs):
     # Explicit Range
     Range1d = []
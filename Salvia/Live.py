@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+from . import Gnuplot
+from . import Session
+
+
+class LivePlot():
+    """ incrementally updated plot of a GnuplotFigure
+
+        the series of the figure are kept as data blocks in a long
+        lived gnuplot session, append sends only the new points and
+        replots. terminal is either an interactive gnuplot terminal
+        or one of the file formats of GnuplotMultiplot, e.g. png
+    """
+
+    def __init__(self, figure, terminal="png", filename=None):
+        self.figure = figure
+        self.terminal = terminal
+        self.mP = Gnuplot.GnuplotMultiplot([figure], filename=filename)
+        self.filename = self.mP.filename
+        self.session = None
+        self.plotted = False
+        self.points = [0 for _ in figure.x]
+        self.watchers = []
+        self.lock = threading.RLock()
+
+    @classmethod
+    def tail(cls, path, x, y, terminal="png", filename=None, **kwargs):
+        """ live plot of columns of a growing csv or log file, see watch """
+        y = y if isinstance(y, list) else [y]
+        figure = Gnuplot.GnuplotFigure(filename=filename)
+        for yi in y:
+            figure.add(x=np.array([]), y=np.array([]), legend=yi, lt="line")
+        figure.x_label.name = x
+        figure.y_label.name = y[0]
+        live = cls(figure, terminal, filename)
+        live.start()
+        live.watch(path, x, y, **kwargs)
+        return live
+
+    @property
+    def is_file_terminal(self):
+        return self.terminal in ("eps", "svg", "png")
+
+    def sync(self, commands):
+        return self.session.run(
+                commands, Gnuplot.rcParams['gnuplot_timeout'], reset=False)
+
+    def start(self):
+        """ start the session and define data blocks of all series """
+        with self.lock:
+            self.session = Session.GnuplotSession()
+            self.mP.set_canvas()
+            self.mP.prepare_dir()
+            cwd = os.path.dirname(os.path.abspath(self.filename))
+            cmds = "cd '{}'\n".format(cwd)
+            if not self.is_file_terminal:
+                cmds += "set terminal {}\n".format(self.terminal)
+            for i in range(len(self.figure.x)):
+                cmds += "$live_{} << EOD\n".format(i)
+                cmds += "".join(self.lines(i))
+                cmds += "EOD\n"
+            self.sync(cmds)
+            if any(self.points):
+                self.refresh()
+        return self
+
+    def lines(self, i, x=None, y=None, z=None):
+        """ formatted data lines of series i or of the given points """
+        f = self.figure
+        if x is None:
+            x, y, z = f.x[i], f.y[i], f.z[i]
+        cols = [np.asarray(c) for c in (x, y, z) if c is not None]
+        self.points[i] += len(cols[1])
+        line = " ".join("{}" for _ in cols) + "\n"
+        return [line.format(*r) for r in zip(*cols)]
+
+    def plot_text(self):
+        f = self.figure
+        svg = self.terminal != "eps"
+        sources = {i: "$live_{} using {}".format(
+                       i, "1:2" if f.z[i] is None else "1:2:3")
+                   for i in range(len(f.x))}
+        text = ""
+        for ax, _range in (("x", f.x_range), ("y", f.y_range)):
+            if _range[0] is not None:
+                text += "set {}range [{:.4g}: {:.4g}]\n".format(
+                        ax, _range[0], _range[1])
+            else:
+                text += "set autoscale {}\n".format(ax)
+        return (text + f.pre_text(svg)
+                + "\nplot " + ", \\\n".join(f.ftext(sources=sources)) + "\n")
+
+    def refresh(self):
+        """ redraw, the full plot command is only sent once """
+        with self.lock:
+            cmd = "replot\n" if self.plotted else self.plot_text()
+            if self.is_file_terminal:
+                header, _ = self.mP.target(self.terminal)
+                cmd = header + cmd + "unset output\n"
+            self.sync(cmd)
+            self.plotted = True
+
+    def append(self, series, x, y, z=None, refresh=True):
+        """ append points to a series given by index or legend name """
+        with self.lock:
+            i = (series if isinstance(series, int)
+                 else self.figure.legend.legends.index(series))
+            lines = self.lines(i, x, y, z)
+            if not lines:
+                return
+            cmds = "set print $live_{} append\n".format(i)
+            cmds += "".join('print "{}"\n'.format(l.strip()) for l in lines)
+            cmds += "unset print\n"
+            self.sync(cmds)
+            if refresh:
+                self.refresh()
+
+    def watch(self, path, x, y, sep=",", interval=0.1, debounce=0.5):
+        """ tail a csv or log file with a header line and append new rows
+            of columns x and y to the series named like the y columns,
+            see FileWatcher for interval and debounce """
+        watcher = FileWatcher(self, path, x, y, sep, interval, debounce)
+        self.watchers.append(watcher)
+        watcher.start()
+        return watcher
+
+    def close(self):
+        for watcher in self.watchers:
+            watcher.stop()
+        with self.lock:
+            if self.session:
+                self.session.close()
+            self.session = None
+
+
+class FileWatcher(threading.Thread):
+    """ polls a growing file every interval seconds and appends complete
+        new rows to a LivePlot, at most once every debounce seconds
+
+        rows read by the polls within debounce seconds after an update
+        are collected and appended together, so interval should be
+        shorter than debounce. With an interval of at least debounce
+        every poll updates the plot. The watcher stops if x or any of
+        the y columns is missing in the header of the file.
+    """
+
+    def __init__(self, live, path, x, y, sep=",", interval=0.1, debounce=0.5):
+        super(FileWatcher, self).__init__(daemon=True)
+        self.live = live
+        self.path = path
+        self.x = x
+        self.y = y if isinstance(y, list) else [y]
+        self.sep = sep
+        self.interval = interval
+        self.debounce = debounce
+        self.offset = 0
+        self.columns = None
+        # indices of x and the y columns in the header
+        self.idx = None
+        self.error = None
+        self.pending = []
+        self.last = 0
+        self.stopped = threading.Event()
+
+    def split(self, line):
+        return [f.strip() for f in line.strip().split(self.sep)]
+
+    def read(self):
+        """ read complete lines appended since the last call """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        lines = [l for l in data[:end].decode("utf-8").split("\n") if l.strip()]
+        if lines and self.columns is None:
+            self.set_columns(self.split(lines.pop(0)))
+        return lines
+
+    def set_columns(self, columns):
+        """ set the header and look up the watched columns once, stops the
+            watcher if any of them is missing """
+        self.columns = columns
+        missing = [c for c in [self.x] + self.y if c not in columns]
+        if missing:
+            self.error = ValueError("columns {} not found in the header {} of {}"
+                                    .format(missing, columns, self.path))
+            print("watching {} failed".format(self.path))
+            print(self.error)
+            self.stop()
+            return
+        self.idx = [columns.index(c) for c in [self.x] + self.y]
+
+    def flush(self):
+        if not self.pending or self.idx is None:
+            return
+        rows = []
+        for line in self.pending:
+            fields = self.split(line)
+            try:
+                rows.append([float(fields[j]) for j in self.idx])
+            except (ValueError, IndexError):
+                continue
+        self.pending = []
+        if not rows:
+            return
+        rows = np.array(rows)
+        for k, name in enumerate(self.y):
+            self.live.append(name, rows[:, 0], rows[:, k + 1], refresh=False)
+        self.live.refresh()
+        self.last = time.time()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.pending += self.read()
+            if time.time() - self.last >= self.debounce:
+                try:
+                    self.flush()
+                except Session.GnuplotError as e:
+                    self.error = e
+                    print("updating the live plot of {} failed".format(self.path))
+                    print(e)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
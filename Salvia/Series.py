@@ -0,0 +1,199 @@
+import weakref
+
+import numpy as np
+
+# axes of a series in the series table
+X, Y, Z = 0, 1, 2
+
+# maximal number of unused rows a buffer grows by
+HEADROOM = 65536
+
+
+class SeriesStore():
+    """ compact storage of the x, y and z columns of the series of a figure
+
+        numeric columns are copied into one contiguous buffer per dtype,
+        so integer columns keep their values and formatting. The columns
+        table holds the (buffer, start, length) of every column and the
+        series table the column numbers of x, y and z of every series,
+        -1 for a missing z. Columns which cannot be stored in a numeric
+        buffer, e.g. tuples, strings or FileColumns, are kept as objects
+        and marked by a buffer of -1 and their index in objects as start.
+        Consecutive series given the same x or z object share the stored
+        column.
+    """
+
+    __slots__ = ("buffers", "used", "dtypes", "columns", "n_columns",
+                 "series", "n_series", "objects", "recent")
+
+    def __init__(self):
+        self.buffers = []
+        self.used = []
+        self.dtypes = []
+        self.columns = np.empty((0, 3), dtype=np.int64)
+        self.n_columns = 0
+        self.series = np.empty((0, 3), dtype=np.int64)
+        self.n_series = 0
+        self.objects = []
+        # id of the objects of the last series to (weakref, column)
+        self.recent = {}
+
+    def __len__(self):
+        return self.n_series
+
+    @staticmethod
+    def grown(arr, n):
+        """ arr with room for at least n rows. The capacity grows by a
+            quarter, at most by HEADROOM rows, to amortise many small
+            appends, and fits exactly if more rows are appended, so
+            large columns leave no slack """
+        if n <= len(arr):
+            return arr
+        headroom = min(len(arr)//4, HEADROOM)
+        ret = np.empty((max(n, len(arr) + headroom),) + arr.shape[1:],
+                       dtype=arr.dtype)
+        ret[:len(arr)] = arr
+        return ret
+
+    def buffer_index(self, dtype):
+        """ index of the buffer holding columns of dtype """
+        try:
+            return self.dtypes.index(dtype)
+        except ValueError:
+            self.dtypes.append(dtype)
+            self.buffers.append(np.empty(0, dtype=dtype))
+            self.used.append(0)
+            return len(self.dtypes) - 1
+
+    def add_column(self, values):
+        if values is None:
+            return -1
+        hit = self.recent.get(id(values))
+        if hit and hit[0]() is values:
+            return hit[1]
+        arr = self.numeric(values)
+        if arr is not None:
+            b, n = self.buffer_index(arr.dtype), len(arr)
+            used = self.used[b]
+            self.buffers[b] = self.grown(self.buffers[b], used + n)
+            self.buffers[b][used:used + n] = arr
+            row = (b, used, n)
+            self.used[b] += n
+        else:
+            row = (-1, len(self.objects), 0)
+            self.objects.append(values)
+        self.columns = self.grown(self.columns, self.n_columns + 1)
+        self.columns[self.n_columns] = row
+        self.n_columns += 1
+        return self.n_columns - 1
+
+    def reserve(self, columns):
+        """ grow the buffers to exactly fit the numeric columns which are
+            about to be added, avoiding the slack of doubling """
+        sizes = {}
+        for c in columns:
+            dtype = getattr(c, "dtype", None)
+            if (isinstance(dtype, np.dtype) and dtype.kind in "biuf"
+                    and np.ndim(c) == 1):
+                sizes[dtype] = sizes.get(dtype, 0) + len(c)
+        for dtype, n in sizes.items():
+            b = self.buffer_index(dtype)
+            used = self.used[b]
+            if used + n > len(self.buffers[b]):
+                buf = np.empty(used + n, dtype=dtype)
+                buf[:used] = self.buffers[b][:used]
+                self.buffers[b] = buf
+
+    @staticmethod
+    def numeric(values):
+        """ values as 1d numeric array keeping their dtype, None if they
+            are not numeric """
+        dtype = getattr(values, "dtype", None)
+        if dtype is None or dtype.kind not in "biuf" or np.ndim(values) != 1:
+            return None
+        try:
+            arr = np.asarray(values)
+        except (TypeError, ValueError):
+            return None
+        return arr if arr.dtype.kind in "biuf" else None
+
+    def remember(self, objs, cols):
+        self.recent = {}
+        for obj, col in zip(objs, cols):
+            try:
+                self.recent[id(obj)] = (weakref.ref(obj), col)
+            except TypeError:
+                pass
+
+    def append(self, x, y, z=None):
+        cols = [self.add_column(v) for v in (x, y, z)]
+        self.series = self.grown(self.series, self.n_series + 1)
+        self.series[self.n_series] = cols
+        self.n_series += 1
+        self.remember((x, y, z), cols)
+
+    def extend(self, other):
+        """ append all series of another store """
+        copied = {-1: -1}
+        for i in range(len(other)):
+            cols = []
+            for c in other.series[i]:
+                if c not in copied:
+                    copied[c] = self.add_column(other.column(c))
+                cols.append(copied[c])
+            self.series = self.grown(self.series, self.n_series + 1)
+            self.series[self.n_series] = cols
+            self.n_series += 1
+        self.recent = {}
+
+    def column(self, c):
+        """ read only view of a numeric column or the stored object """
+        if c < 0:
+            return None
+        b, start, n = self.columns[c]
+        if b < 0:
+            return self.objects[start]
+        view = self.buffers[b][start:start + n]
+        view.flags.writeable = False
+        return view
+
+    def get(self, i, axis):
+        return self.column(self.series[i, axis])
+
+    def token(self, i, axis):
+        """ hashable identity of the column of series i on axis """
+        return (id(self), int(self.series[i, axis]))
+
+    @property
+    def nbytes(self):
+        return (sum(buf.nbytes for buf in self.buffers)
+                + self.columns.nbytes + self.series.nbytes)
+
+
+class SeriesAxis():
+    """ sequence of the columns of all series of a store along one axis """
+
+    __slots__ = ("store", "axis")
+
+    def __init__(self, store, axis):
+        self.store = store
+        self.axis = axis
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("series index out of range")
+        return self.store.get(i, self.axis)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.store.get(i, self.axis)
+
+    def token(self, i):
+        return self.store.token(i, self.axis)
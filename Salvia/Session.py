@@ -0,0 +1,217 @@
+import subprocess
+import threading
+import queue
+import time
+import atexit
+
+SENTINEL = "SALVIA_JOB_DONE"
+# precedes the error number of the last job on stderr
+ERRNO = "SALVIA_ERRNO"
+
+
+class GnuplotError(Exception):
+    pass
+
+
+class GnuplotSession():
+    """ a long lived gnuplot process driven over its stdin pipe
+
+        every job is terminated by closing the output, printing and
+        resetting GPVAL_ERRNO, resetting the session and printing a
+        sentinel to stderr, which marks the job as finished
+    """
+
+    def __init__(self, cmd="gnuplot"):
+        self.cmd = cmd
+        self.jobs = 0
+        self.proc = subprocess.Popen(
+                [cmd],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                bufsize=1)
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        for line in self.proc.stderr:
+            self.lines.put(line)
+        # None signals that the process has closed its stderr
+        self.lines.put(None)
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, commands):
+        self.proc.stdin.write(commands)
+        self.proc.stdin.flush()
+
+    def run(self, commands, timeout=None, reset=True):
+        """ send commands and block until the sentinel is received,
+            returns everything gnuplot wrote to stderr meanwhile and
+            raises a GnuplotError with it if the commands failed. Unless
+            reset is False the session state is cleared afterwards """
+        self.jobs += 1
+        if reset:
+            commands += "\nunset output"
+        commands += "\nprint '{}', GPVAL_ERRNO\nreset errors".format(ERRNO)
+        if reset:
+            commands += "\nreset session"
+        try:
+            self.send(commands + "\nprint '{}'\n".format(SENTINEL))
+        except (BrokenPipeError, OSError) as e:
+            raise GnuplotError("gnuplot session died: {}".format(e))
+
+        output = []
+        errno = 0
+        deadline = (time.time() + timeout) if timeout else None
+        while True:
+            wait = max(deadline - time.time(), 0) if deadline else None
+            try:
+                line = self.lines.get(timeout=wait)
+            except queue.Empty:
+                raise GnuplotError("gnuplot timed out after {}s".format(timeout))
+            if line is None:
+                raise GnuplotError("gnuplot exited: {}".format("".join(output)))
+            if line.startswith(ERRNO):
+                errno = int(line.split()[-1])
+                continue
+            if line.strip() == SENTINEL:
+                if errno:
+                    raise GnuplotError("".join(output))
+                return "".join(output)
+            output.append(line)
+
+    def load(self, script, cwd, timeout=None):
+        return self.run("cd '{}'\nload '{}'".format(cwd, script), timeout)
+
+    def stream(self, chunks, cwd, timeout=None):
+        """ send a script given as iterable of chunks """
+        try:
+            self.send("cd '{}'\n".format(cwd))
+            for chunk in chunks:
+                self.send(chunk)
+        except (BrokenPipeError, OSError) as e:
+            raise GnuplotError("gnuplot session died: {}".format(e))
+        return self.run("", timeout)
+
+    def close(self):
+        if self.alive:
+            try:
+                self.send("exit\n")
+                self.proc.wait(timeout=1)
+            except Exception:
+                self.proc.kill()
+        else:
+            self.proc.wait()
+
+
+class GnuplotPool():
+    """ a bounded pool of gnuplot sessions
+
+        sessions are created lazily, checked for liveness before each
+        job and recycled after failures, timeouts or max_jobs jobs
+    """
+
+    def __init__(self, size=2, cmd="gnuplot", timeout=60, max_jobs=500):
+        self.size = size
+        self.cmd = cmd
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.idle = queue.Queue()
+        self.slots = threading.Semaphore(size)
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def grow(self, size):
+        """ allow up to size concurrent sessions """
+        with self.lock:
+            for _ in range(size - self.size):
+                self.slots.release()
+            self.size = max(size, self.size)
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            session = self.idle.get_nowait()
+        except queue.Empty:
+            session = None
+        if session and not self.healthy(session):
+            self.discard(session)
+            session = None
+        if not session:
+            try:
+                session = GnuplotSession(self.cmd)
+            except Exception:
+                self.slots.release()
+                raise
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def release(self, session):
+        self.idle.put(session)
+        self.slots.release()
+
+    def healthy(self, session):
+        return session.alive and session.jobs < self.max_jobs
+
+    def discard(self, session):
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+        session.proc.kill()
+        session.proc.wait()
+
+    def load(self, script, cwd, timeout=None):
+        """ run a script file in cwd on a pooled session """
+        return self.job("load", script, cwd, timeout or self.timeout)
+
+    def stream(self, chunks, cwd, timeout=None):
+        """ run a script given as iterable of chunks in cwd """
+        return self.job("stream", chunks, cwd, timeout or self.timeout)
+
+    def job(self, method, script, cwd, timeout):
+        session = self.acquire()
+        try:
+            output = getattr(session, method)(script, cwd, timeout)
+        except Exception:
+            self.discard(session)
+            self.slots.release()
+            raise
+        self.release(session)
+        return output
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+        self.idle = queue.Queue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(size=2, cmd="gnuplot", timeout=60, max_jobs=500):
+    """ return the shared pool, creating it on first use """
+    global _pool
+    with _pool_lock:
+        if not _pool:
+            _pool = GnuplotPool(size, cmd, timeout, max_jobs)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool:
+            _pool.close()
+        _pool = None
+
+
+atexit.register(close_pool)
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class RenderStats():
+    """ timings and counters of a render
+
+        phases maps the phase name to the accumulated seconds:
+          style   applying the style of the multiplot
+          data    collecting and serialising the data blocks
+          body    generating the plot commands, includes ranges
+          ranges  computing the axis ranges
+          write   writing the script to disk
+        gnuplot maps the rendered terminals to the wall time of the
+        gnuplot call, scripts streamed to gnuplot include the time to
+        generate them. points maps (subplot, series) to the number of
+        points emitted after decimation.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.phases = OrderedDict()
+        self.gnuplot = OrderedDict()
+        self.points = OrderedDict()
+        self.bytes_written = 0
+        self.started = time.time()
+        self.total = None
+
+    def add(self, phase, seconds, into=None):
+        into = self.phases if into is None else into
+        into[phase] = into.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase, into=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, into)
+
+    def timed(self, phase, chunks):
+        """ yields from chunks, timing only the production of the chunks """
+        it = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(it)
+            except StopIteration:
+                self.add(phase, time.perf_counter() - start)
+                return
+            self.add(phase, time.perf_counter() - start)
+            yield chunk
+
+    def counted(self, chunks):
+        """ yields from chunks, counting the written bytes """
+        for chunk in chunks:
+            self.bytes_written += len(chunk)
+            yield chunk
+
+    def finish(self):
+        self.total = time.time() - self.started
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "total": self.total,
+            "phases": dict(self.phases),
+            "gnuplot": dict(self.gnuplot),
+            "bytes_written": self.bytes_written,
+            "points": {"{} {}".format(*k): n for k, n in self.points.items()},
+        }
+
+    def text(self):
+        lines = ["# {} {}".format(
+                 time.strftime("%Y-%m-%dT%H:%M:%S",
+                               time.localtime(self.started)), self.name)]
+        if self.total is not None:
+            lines.append("total {:.6f}".format(self.total))
+        for phase, seconds in self.phases.items():
+            lines.append("phase {} {:.6f}".format(phase, seconds))
+        for terminal, seconds in self.gnuplot.items():
+            lines.append("gnuplot {} {:.6f}".format(terminal, seconds))
+        lines.append("bytes_written {}".format(self.bytes_written))
+        for (pid, i), n in self.points.items():
+            lines.append("points {} {} {}".format(pid, i, n))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """ append the stats to a text file """
+        with open(path, "a") as f:
+            f.write(self.text())
+
+    def __repr__(self):
+        return self.text()
@@ -1,3 +1,9 @@
+from itertools import count
+
+# unique tokens of the stylers, ids are reused once a styler is collected
+_tokens = count()
+
+
 class TemplateMargins():
 
     @classmethod
@@ -6,17 +12,30 @@ class TemplateMargins():
 
 class Styler():
 
+    # stylers which give a different result when applied twice, like
+    # ReverseRange, are applied only once per figure
+    idempotent = True
+
     def __init__(self, func, slyce=None, prev=None):
         self.slyce = slyce
         self.prev = prev
         self.func = func
+        self.token = next(_tokens)
 
     def __call__(self, figures):
-        if self.prev:
-           figures = self.prev.__call__(figures)
-        figures_items = figures.data.items()
-        self.iterate(figures_items)
-        return figures
+        return self.compile()(figures)
+
+    def stages(self):
+        """ the stylers of the chain ending in self, first to last """
+        stages = []
+        styler = self
+        while styler:
+            stages.append(styler)
+            styler = styler.prev
+        return stages[::-1]
+
+    def compile(self):
+        return CompiledStyle(self.stages())
 
     def _repr_svg_(self):
         return self.figures._repr_svg_()
@@ -27,6 +46,43 @@ class Styler():
         for i, f in figures:
             self.func(f)
 
+class CompiledStyle():
+    """ a flattened chain of stylers applied in a single pass over the
+        figures of a multiplot
+
+        every figure records the chain and the revision the style was
+        applied to in figure.styled, keyed weakly by the last styler of
+        the chain. Unchanged figures are skipped on later calls so that
+        styles are applied only once per figure revision. Stylers which
+        are not idempotent are never applied twice to a figure
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.last = stages[-1]
+        self.key = tuple(s.token for s in stages)
+
+    def __call__(self, figures):
+        items = list(figures.data.items())
+        n = len(items)
+        selected = [set(range(n)[s.slyce]) if s.slyce else None
+                    for s in self.stages]
+        for i, (_, f) in enumerate(items):
+            styled = getattr(f, "styled", {})
+            revision = getattr(f, "revision", None)
+            key, applied_revision = styled.get(self.last, (None, None))
+            applied = key == self.key
+            if applied and applied_revision == revision:
+                continue
+            for stage, sel in zip(self.stages, selected):
+                if applied and not stage.idempotent:
+                    continue
+                if sel is None or i in sel:
+                    stage.func(f)
+            styled[self.last] = (self.key, revision)
+        return figures
+
+
 def chain(Self, *obj):
     if len(obj) > 1:
         for i, o in enumerate(obj[1:]):
@@ -61,6 +117,8 @@ class MirrorAxis(Styler):
 
 class ReverseRange(Styler):
 
+    idempotent = False
+
     def __init__(self, name, slyce=None, prev=None):
         self.name = name
         Styler.__init__(self, func=self.func, slyce=slyce, prev=prev)
@@ -111,7 +169,8 @@ class CleanColormaps(Styler):
 
     def func(self, figure):
         attr = getattr(figure, "pre_set")
-        attr.append("unset colorbox\n")
+        if "unset colorbox\n" not in attr:
+            attr.append("unset colorbox\n")
         # attr = getattr(figure, "post_set")
         # attr.append("set colorbox\n")
 
@@ -133,7 +192,9 @@ class BgColor(Styler):
 
     def func(self, figure):
         attr = getattr(figure, "pre_set")
-        attr.append(" ".format(self.color))
+        if " ".format(self.color) not in attr:
+            attr.append(" ".format(self.color))
         attr = getattr(figure, "post_set")
-        attr.append("set background rgb white\n")
+        if "set background rgb white\n" not in attr:
+            attr.append("set background rgb white\n")
 
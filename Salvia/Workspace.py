@@ -0,0 +1,88 @@
+import os
+import time
+import shutil
+import threading
+import uuid
+
+PREFIX = "SalviaPlot-"
+
+
+class Workspace():
+    """ hands out a unique directory per render below root
+
+        directories are only created by prepare before the first file
+        is written to them. Old render directories are removed once
+        they exceed max_age seconds or, least recently modified first,
+        while the total size exceeds max_bytes. A directory counts as
+        modified when it is prepared or one of its files is written.
+        Directories modified within the last min_age seconds are never
+        removed since they might still be in use by a concurrent render.
+    """
+
+    def __init__(self, root, max_bytes=1024**3, max_age=24*3600,
+                 min_age=600, cleanup_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = 0
+        self.lock = threading.Lock()
+
+    def filename(self, name="SalviaPlot"):
+        """ unique base filename for the scripts and images of a render,
+            its directory is not created before prepare is called """
+        return os.path.join(self.root, PREFIX + uuid.uuid4().hex, name)
+
+    def prepare(self, filename):
+        """ (re)create the directory of filename and mark it as in use,
+            cleaning up old directories at most every cleanup_interval
+            seconds before """
+        with self.lock:
+            due = time.time() - self.last_cleanup >= self.cleanup_interval
+            if due:
+                self.last_cleanup = time.time()
+        if due:
+            self.cleanup()
+        path = os.path.dirname(filename) or "."
+        os.makedirs(path, exist_ok=True)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def dirs(self):
+        """ (mtime, size, path) of all render directories, oldest first,
+            mtime is that of the directory or its newest file """
+        ret = []
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return ret
+        for entry in entries:
+            if not entry.name.startswith(PREFIX) or not entry.is_dir():
+                continue
+            try:
+                mtime, size = entry.stat().st_mtime, 0
+                for f in os.scandir(entry.path):
+                    if f.is_file():
+                        stat = f.stat()
+                        mtime = max(mtime, stat.st_mtime)
+                        size += stat.st_size
+                ret.append((mtime, size, entry.path))
+            except OSError:
+                continue
+        return sorted(ret)
+
+    def cleanup(self):
+        """ apply the retention policy """
+        entries = self.dirs()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            if now - mtime < self.min_age:
+                break
+            if now - mtime < self.max_age and total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+""" benchmarks of script generation and rendering
+
+    runs every workload over a grid of total data points and number of
+    subplots and writes the timings as json, e.g.
+
+        python bench/bench.py --stub --output results.json
+        python bench/bench.py --quick --baseline results.json
+
+    points are the total number of rows of all subplots, every subplot
+    draws two y columns over a shared x column. Line series are not
+    decimated unless --decimate is given, so that all points are
+    serialised. With --stub the gnuplot
+    binary is replaced by bench/stub/gnuplot, so write_file only measures
+    the python side.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+import pandas as pd
+
+from Salvia import Gnuplot
+from Salvia import Style
+
+POINTS = [10**3, 10**4, 10**5, 10**6, 10**7]
+SUBPLOTS = [1, 10, 200]
+QUICK_POINTS = [10**3, 10**5]
+QUICK_SUBPLOTS = [1, 10]
+
+
+def build(points, subplots, root):
+    """ multiplot of subplots figures sharing points rows in total """
+    rng = np.random.RandomState(0)
+    rows = max(points // subplots, 2)
+    figures = []
+    for _ in range(subplots):
+        x = np.linspace(0, 1, rows)
+        df = pd.DataFrame({
+            "x": x,
+            "y0": np.sin(20 * x) + rng.randn(rows) * 0.1,
+            "y1": np.cos(20 * x) + rng.randn(rows) * 0.1})
+        figures.append(Gnuplot.draw(x="x", y=["y0", "y1"], data=df))
+    return Gnuplot.GnuplotMultiplot(
+            figures, filename=os.path.join(root, "bench"))
+
+
+def style_chain():
+    return Style.chain(None,
+            Style.CleanAxis("x", slyce=slice(0, -1)),
+            Style.Legend("top left"),
+            Style.ReverseRange("y"),
+            Style.CleanColormaps(),
+            Style.BgColor("white"))
+
+
+def ranges(m):
+    for _, f in m.data.items():
+        f.extrema = {}
+        f.xrange, f.yrange
+
+
+def inline_data_blocks(m):
+    m.str_inline_data_blocks(m.data)
+
+
+def text(m):
+    m.text(svg=True)
+
+
+def style(m):
+    style_chain()(m)
+
+
+def write_file(m):
+    m.write_file()
+
+
+WORKLOADS = [
+    ("ranges", ranges, False),
+    ("str_inline_data_blocks", inline_data_blocks, False),
+    ("text", text, False),
+    ("style", style, False),
+    ("write_file", write_file, True),
+]
+
+
+def measure(func, m, repeat):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(m)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(args):
+    if args.stub:
+        os.environ["PATH"] = (os.path.join(HERE, "stub")
+                              + os.pathsep + os.environ["PATH"])
+    has_gnuplot = shutil.which("gnuplot") is not None
+    Gnuplot.rcParams['data_transport'] = args.transport
+    Gnuplot.rcParams['decimate'] = args.decimate
+
+    points = args.points or (QUICK_POINTS if args.quick else POINTS)
+    subplots = args.subplots or (QUICK_SUBPLOTS if args.quick else SUBPLOTS)
+    selected = [w for w in WORKLOADS
+                if not args.only or w[0] in args.only]
+
+    results = []
+    for n in points:
+        for s in subplots:
+            root = tempfile.mkdtemp(prefix="SalviaBench-")
+            try:
+                Gnuplot.rcParams['workspace_root'] = root
+                m = build(n, s, root)
+                for name, func, needs_gnuplot in selected:
+                    if needs_gnuplot and not has_gnuplot:
+                        print("skipping {}, gnuplot not found, see --stub"
+                              .format(name), file=sys.stderr)
+                        continue
+                    times = measure(func, m, args.repeat)
+                    result = {
+                        "name": name,
+                        "points": n,
+                        "subplots": s,
+                        "min": min(times),
+                        "mean": sum(times) / len(times),
+                        "times": times,
+                    }
+                    results.append(result)
+                    print("{:<24}{:>10}{:>6}{:>12.4f}s".format(
+                          name, n, s, result["min"]), file=sys.stderr)
+                del m
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "stub": args.stub,
+            "gnuplot": shutil.which("gnuplot"),
+            "data_transport": args.transport,
+            "decimate": args.decimate,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """ print the ratio of the min times to those of a previous run """
+    with open(baseline) as f:
+        old = {(r["name"], r["points"], r["subplots"]): r["min"]
+               for r in json.load(f)["results"]}
+    for r in report["results"]:
+        key = (r["name"], r["points"], r["subplots"])
+        if key in old and old[key] > 0:
+            print("{:<24}{:>10}{:>6}{:>10.2f}x".format(
+                  *key, r["min"] / old[key]), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--stub", action="store_true",
+            help="use bench/stub/gnuplot instead of gnuplot")
+    parser.add_argument("--quick", action="store_true",
+            help="small grid for a fast check")
+    parser.add_argument("--points", type=int, nargs="+")
+    parser.add_argument("--subplots", type=int, nargs="+")
+    parser.add_argument("--only", nargs="+",
+            choices=[w[0] for w in WORKLOADS])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--transport", default="inline",
+            choices=["inline", "binary", "auto", "mmap"],
+            help="rcParams['data_transport'] used for all workloads")
+    parser.add_argument("--decimate", action="store_true",
+            help="decimate line series as rcParams['decimate'] does by default")
+    parser.add_argument("--output",
+            help="write the json report to this file instead of stdout")
+    parser.add_argument("--baseline",
+            help="json report of a previous run to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
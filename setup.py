@@ -27,6 +27,7 @@ config = {
     'version': version_git,
     'packages': [package_name],
     'name': package_name,
+    'install_requires': ['numpy', 'pandas'],
     'zip_safe': False
 }
 